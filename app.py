@@ -0,0 +1,118 @@
+import logging
+import os
+import asyncio
+from dotenv import load_dotenv
+from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application, ip_filter_middleware
+from aiogram.webhook.security import DEFAULT_TELEGRAM_NETWORKS, IPFilter
+from aiohttp import web
+
+from handlers import register_all_handlers
+from ytdl_pool import start_pool, shutdown_pool
+from http_client import create_http_session
+from metrics import setup_metrics, start_metrics_server
+from flood_control import get_flood_control
+from workspace import start_sweeper
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Serves updates over a webhook instead of long polling. The bot listens on
+    plain HTTP (WEBAPP_HOST:WEBAPP_PORT) so TLS can be terminated by a reverse
+    proxy or load balancer in front of it. Settings come from the environment:
+
+    WEBHOOK_BASE_URL  Public https URL that Telegram should call. If unset the
+                      webhook is not registered, which is handy for local tests
+                      where updates are POSTed to the endpoint by hand.
+    WEBHOOK_PATH      Path of the update endpoint (default: /webhook).
+    WEBHOOK_SECRET    Secret Telegram sends in X-Telegram-Bot-Api-Secret-Token.
+    WEBHOOK_CHECK_IP  Set to 1 to only accept requests from Telegram's networks.
+    """
+    base_url = os.getenv("WEBHOOK_BASE_URL")
+    path = os.getenv("WEBHOOK_PATH", "/webhook")
+    secret = os.getenv("WEBHOOK_SECRET") or None
+    host = os.getenv("WEBAPP_HOST", "0.0.0.0")
+    port = int(os.getenv("WEBAPP_PORT", "8080"))
+
+    app = web.Application()
+    if os.getenv("WEBHOOK_CHECK_IP") == "1":
+        # Honours X-Forwarded-For, so this also works behind a proxy
+        app.middlewares.append(ip_filter_middleware(IPFilter(DEFAULT_TELEGRAM_NETWORKS)))
+
+    # Answer Telegram right away and process the update in the background
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=True).register(app, path=path)
+    app.router.add_get("/healthz", lambda request: web.Response(text="ok"))
+    setup_application(app, dp, bot=bot)
+
+    if base_url:
+        await bot.set_webhook(
+            f"{base_url.rstrip('/')}{path}",
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=True,
+        )
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Listening for webhook updates on http://%s:%d%s", host, port, path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+async def main():
+    # Load environment variables
+    load_dotenv()
+    BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+    # Configure logging
+    logging.basicConfig(level=logging.INFO)
+
+    # Spawn the yt-dlp worker processes early so they are warm for the first download
+    start_pool()
+
+    # Remove job workspaces a crashed run left behind, then keep sweeping periodically
+    sweeper = start_sweeper()
+
+    # Initialize Bot and Dispatcher
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    dp = Dispatcher()
+
+    # Pace everything sent to chats so we stay under Telegram's flood limits.
+    # Registered first so it wraps the other request middlewares.
+    bot.session.middleware(get_flood_control())
+
+    # One pooled HTTP session shared by every handler that talks to an external API
+    http_session = create_http_session()
+
+    # Look up the bot's own account once instead of in every handler that needs it
+    bot_info = await bot.get_me()
+
+    # Register all handlers from the handlers package
+    register_all_handlers(dp, bot, http_session, bot_info)
+
+    # Expose Prometheus metrics on a local port (METRICS_PORT=0 turns this off)
+    setup_metrics(dp, bot)
+    metrics_runner = await start_metrics_server()
+    
+    # BOT_MODE selects how updates arrive: "polling" (default) or "webhook"
+    mode = os.getenv("BOT_MODE", "polling").lower()
+
+    try:
+        if mode == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Before polling, delete any pending updates to avoid firing old commands on restart
+            await bot.delete_webhook(drop_pending_updates=True)
+
+            # Start polling
+            await dp.start_polling(bot)
+    finally:
+        sweeper.cancel()
+        await http_session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        shutdown_pool()
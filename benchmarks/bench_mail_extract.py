@@ -0,0 +1,82 @@
+"""
+Compares the lxml-based extract_otp_and_links with the original
+BeautifulSoup implementation over a corpus of realistic emails.
+
+Run from the repository root:
+    python -m benchmarks.bench_mail_extract
+"""
+import re
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+
+from benchmarks.mail_corpus import build_corpus
+from handlers.temp_mail_handler import extract_otp_and_links
+
+
+def legacy_extract_otp_and_links(html_content: str) -> dict:
+    """The BeautifulSoup implementation this benchmark measures against."""
+    if not html_content:
+        return {'otps': [], 'links': []}
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    text = soup.get_text(separator=' ')
+    otp_patterns = [
+        r'(\b\d{6}\b)',
+        r'code is:\s*(\d+)',
+        r'verification code:\s*(\d+)',
+        r'security code:\s*(\w+)'
+    ]
+    otps = []
+    for pattern in otp_patterns:
+        for match in re.findall(pattern, text, re.IGNORECASE):
+            if match not in otps:
+                otps.append(match)
+
+    verification_links = []
+    link_keywords = ['verify', 'confirm', 'activate', 'validate', 'complete']
+    for a in soup.find_all('a', href=True):
+        link_text = a.get_text().lower()
+        if any(keyword in link_text for keyword in link_keywords):
+            verification_links.append({'text': a.get_text(strip=True), 'href': a['href']})
+    return {'otps': otps, 'links': verification_links}
+
+
+def time_corpus(func, corpus, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _, html in corpus:
+            func(html)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5, help="timing rounds; the best one is reported")
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+    total_kb = sum(len(html) for _, html in corpus) / 1024
+    print(f"Corpus: {len(corpus)} emails, {total_kb:.0f} KB")
+
+    # Both implementations must find the same links; OTPs may only differ where
+    # the old one picked up numbers from <style>/<script> blocks
+    for name, html in corpus:
+        old, new = legacy_extract_otp_and_links(html), extract_otp_and_links(html)
+        assert old['links'] == new['links'], name
+        assert set(new['otps']) <= set(old['otps']), name
+
+    for label, group in (("all", corpus),
+                         ("small (<64 KB)", [c for c in corpus if len(c[1]) < 64 * 1024]),
+                         ("large (>=64 KB)", [c for c in corpus if len(c[1]) >= 64 * 1024])):
+        legacy = time_corpus(legacy_extract_otp_and_links, group, args.rounds)
+        current = time_corpus(extract_otp_and_links, group, args.rounds)
+        print(f"{label:>16}: legacy {legacy * 1000:8.1f} ms   current {current * 1000:8.1f} ms   "
+              f"speedup x{legacy / current:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Builds a deterministic corpus of realistic emails for the temp mail benchmarks:
+short OTP notices, transactional mails with inline CSS and tables, and large
+marketing newsletters of a few hundred KB.
+"""
+import random
+
+STYLE_BLOCK = """
+<style type="text/css">
+  body { margin: 0; padding: 0; background-color: #f4f4f4; font-family: Helvetica, Arial, sans-serif; }
+  .container { width: 600px; margin: 0 auto; background: #ffffff; }
+  .button { background-color: #1a73e8; color: #ffffff; padding: 12px 24px; border-radius: 4px; }
+  .footer { color: #888888; font-size: 12px; }
+  @media only screen and (max-width: 600px) { .container { width: 100% !important; } }
+</style>
+"""
+
+TRACKING_SCRIPT = "<script>window.__track = {id: 'abc', ts: 1700000000};</script>"
+
+
+def otp_email(rng):
+    code = f"{rng.randint(0, 999999):06d}"
+    return f"""<html><head><title>Your verification code</title>{STYLE_BLOCK}</head>
+<body><div class="container">
+  <p>Hello,</p>
+  <p>Your verification code: {code}</p>
+  <p>This code expires in 10 minutes. If you didn't request it, ignore this email.</p>
+  <p class="footer">Sent by Example Inc.</p>
+</div></body></html>"""
+
+
+def transactional_email(rng):
+    rows = "".join(
+        f"<tr><td>Item #{rng.randint(1000, 9999)}</td><td>{rng.randint(1, 5)}</td><td>${rng.randint(1, 300)}.{rng.randint(0, 99):02d}</td></tr>"
+        for _ in range(25)
+    )
+    token = "".join(rng.choice("abcdef0123456789") for _ in range(40))
+    return f"""<!DOCTYPE html><html><head><meta charset="utf-8">{STYLE_BLOCK}</head>
+<body><table class="container" cellpadding="0" cellspacing="0">
+  <tr><td><h1>Welcome aboard!</h1><p>Please confirm your account to get started.</p></td></tr>
+  <tr><td><a class="button" href="https://example.com/verify?token={token}">Confirm my email</a></td></tr>
+  <tr><td><table>{rows}</table></td></tr>
+  <tr><td><p>Your security code: {rng.randint(100000, 999999)}</p></td></tr>
+  <!-- tracking pixel -->
+  <tr><td><img src="https://example.com/open.gif" width="1" height="1"></td></tr>
+</table>{TRACKING_SCRIPT}</body></html>"""
+
+
+def marketing_email(rng, blocks=400):
+    products = []
+    for i in range(blocks):
+        products.append(f"""
+<table class="product" width="100%" cellpadding="0" cellspacing="0" style="border-bottom:1px solid #eeeeee">
+  <tr>
+    <td width="120"><img src="https://cdn.example.com/p/{i}.jpg" alt="Product {i}" width="120"></td>
+    <td style="padding:8px;font-family:Arial">
+      <h3 style="margin:0">Limited offer on product {i}</h3>
+      <p style="margin:4px 0">Save {rng.randint(5, 70)}% today only. Order number {rng.randint(10**8, 10**9)}.</p>
+      <a href="https://shop.example.com/p/{i}?utm_source=mail&amp;utm_campaign=spring">Shop now</a>
+    </td>
+  </tr>
+</table>""")
+    return f"""<html><head>{STYLE_BLOCK}</head><body><div class="container">
+<h1>Spring sale</h1>
+{''.join(products)}
+<p>To keep receiving our offers, please <a href="https://shop.example.com/confirm-subscription">confirm your subscription</a>.</p>
+<p class="footer">Unsubscribe at any time.</p>
+</div>{TRACKING_SCRIPT}</body></html>"""
+
+
+def build_corpus(seed=1234):
+    """Returns a list of (name, html) pairs."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(20):
+        corpus.append((f"otp_{i}", otp_email(rng)))
+    for i in range(10):
+        corpus.append((f"transactional_{i}", transactional_email(rng)))
+    for i in range(3):
+        corpus.append((f"marketing_{i}", marketing_email(rng)))
+    return corpus
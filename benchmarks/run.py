@@ -0,0 +1,161 @@
+"""
+Micro-benchmarks for the bot's pure hot-path functions.
+
+Run from the repository root:
+    python -m benchmarks.run                         # print timings
+    python -m benchmarks.run --save                  # also write them as the baseline
+    python -m benchmarks.run --compare               # fail if anything got slower than the baseline
+    python -m benchmarks.run --compare --threshold 0.25 -k qr
+
+Timings depend on the machine, so baselines are not committed: save one on
+the machine you compare on (e.g. before starting a change).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+from benchmarks.mail_corpus import build_corpus
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_cases():
+    """Returns {name: zero-argument callable}. Inputs are prepared here, outside the timed code."""
+    from utils import format_duration, compute_bitrates
+    from keyboards.inline import get_main_menu_keyboard
+    from keyboards.callbacks import YouTubeCallback
+    from handlers.temp_mail_handler import extract_otp_and_links
+    from handlers.youtube import format_buttons
+    from handlers.qr_handler import render_qr_png
+
+    durations = [0, 7, 59, 61, 3599, 3600, 86399, None, 212.5]
+    mails = dict(build_corpus())
+    otp_mail = next(html for name, html in mails.items() if name.startswith("otp"))
+    marketing_mail = max(mails.values(), key=len)
+    packed = YouTubeCallback(video_id="dQw4w9WgXcQ", quality="720", ext="mp4", mode="split").pack()
+    yt_video = load_fixture("yt_video.json")
+    yt_stream = load_fixture("yt_stream.json")
+
+    return {
+        "format_duration": lambda: [format_duration(d) for d in durations],
+        "compute_bitrates": lambda: [compute_bitrates(d) for d in (15, 212, 600, 3600, 10823)],
+        "extract_otp_and_links.otp_mail": lambda: extract_otp_and_links(otp_mail),
+        "extract_otp_and_links.large_mail": lambda: extract_otp_and_links(marketing_mail),
+        "get_main_menu_keyboard": lambda: get_main_menu_keyboard(0),
+        "YouTubeCallback.pack": lambda: YouTubeCallback(video_id="dQw4w9WgXcQ", quality="720", ext="mp4", mode="split").pack(),
+        "YouTubeCallback.unpack": lambda: YouTubeCallback.unpack(packed),
+        "yt_format_buttons.video": lambda: format_buttons(yt_video),
+        "yt_format_buttons.stream": lambda: format_buttons(yt_stream, "split"),
+        "render_qr_png.url": lambda: render_qr_png("https://telegram.org"),
+        "render_qr_png.long_text": lambda: render_qr_png("https://example.com/?q=" + "x" * 400),
+    }
+
+
+def measure(func, repeat, min_time):
+    """
+    Returns the best per-call time in seconds over `repeat` runs, each run
+    calling `func` enough times to last at least `min_time` seconds.
+    """
+    func()  # warm up imports and caches
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed / loops
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.0f} ns"
+
+
+def compare(results, baseline, threshold):
+    """Prints each case against the baseline and returns the names that regressed."""
+    regressions = []
+    for name, seconds in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print(f"{name:<40} {format_time(seconds)}   (no baseline)")
+            continue
+        change = seconds / old - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<40} {format_time(seconds)}   baseline {format_time(old)}   {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-k", dest="pattern", default="", help="only run cases whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per case; the best one is kept")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum seconds per timing run")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="write the results to the baseline file")
+    parser.add_argument("--compare", action="store_true", help="compare against the baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown before a case counts as a regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    cases = {name: func for name, func in build_cases().items() if args.pattern in name}
+    baseline = {}
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, func in cases.items():
+        results[name] = measure(func, args.repeat, args.min_time)
+        if not args.compare:
+            print(f"{name:<40} {format_time(results[name])}")
+
+    regressions = compare(results, baseline, args.threshold) if args.compare else []
+
+    if args.save:
+        # Keep the baseline of cases that were filtered out with -k
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                saved = json.load(f)["results"]
+        saved.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": saved,
+            }, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}: "
+              + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
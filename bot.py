@@ -1,36 +1,15 @@
-import logging
-import os
-import asyncio
-from dotenv import load_dotenv
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-
-from handlers import register_all_handlers
-
-async def main():
-    # Load environment variables
-    load_dotenv()
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
+"""
+Entry point: python bot.py
 
-    # Configure logging
-    logging.basicConfig(level=logging.INFO)
-
-    # Initialize Bot and Dispatcher
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher()
-
-    # Register all handlers from the handlers package
-    register_all_handlers(dp, bot)
-    
-    # Before polling, delete any pending updates to avoid firing old commands on restart
-    await bot.delete_webhook(drop_pending_updates=True)
-    
-    # Start polling
-    await dp.start_polling(bot)
+The bot itself lives in app.py. This script stays free of imports because the
+yt-dlp workers are spawned processes that re-run it to rebuild __main__; with
+the bot loaded only under the guard below, they import nothing but ytdl_pool.
+"""
+import asyncio
 
 if __name__ == '__main__':
+    from app import main
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("Bot stopped manually.")
\ No newline at end of file
+        print("Bot stopped manually.")
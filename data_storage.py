@@ -1,5 +1,115 @@
-# This dictionary will store our temporary email data.
-# The key will be a unique ID, and the value will be another dictionary
-# containing the 'token' and 'address'.
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from cache import TTLCache
+
+
+class MemoryStorage:
+    """
+    Keeps values in process memory. Entries expire after `ttl` seconds and
+    the least recently used ones are dropped beyond `maxsize`, so memory
+    stays flat no matter how long the bot runs. Lost on restart.
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key, default=None):
+        return self._cache.get(key, default)
+
+    def set(self, key, value):
+        self._cache.set(key, value)
+
+    def delete(self, key):
+        self._cache.pop(key)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class SQLiteStorage:
+    """
+    Keeps JSON-serialisable values in a SQLite file, so they survive restarts
+    and can be shared by several bot processes on the same host. Each
+    storage uses its own `namespace` in the shared table. With a `ttl`,
+    entries expire that many seconds after they were last written.
+    """
+
+    def __init__(self, path: str, namespace: str, ttl: float = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS kv_expires_at ON kv (expires_at)")
+        self._conn.commit()
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (self.namespace, key, time.time()),
+            ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), expires_at),
+            )
+            self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM kv WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (self.namespace, time.time()),
+            ).fetchone()
+        return count
+
+
+def create_storage(namespace: str, ttl: float = None, maxsize: int = 10000):
+    """
+    Builds a storage for one kind of data. STORAGE_BACKEND picks the backend
+    ("memory" or "sqlite", the default) and STORAGE_DB the SQLite file.
+    """
+    if os.getenv("STORAGE_BACKEND", "sqlite").lower() == "memory":
+        return MemoryStorage(ttl=ttl or float("inf"), maxsize=maxsize)
+    return SQLiteStorage(os.getenv("STORAGE_DB", "bot_storage.sqlite3"), namespace, ttl)
+
+
+# Temporary email sessions, keyed by a unique session id.
+# The value is a dictionary with the 'token' and 'address' of the mailbox.
 # Example: {'some_unique_id': {'token': '...', 'address': '...'}}
-temp_mail_data = {}
\ No newline at end of file
+_temp_mail_data = None
+
+def get_temp_mail_storage():
+    """Returns the temp mail session storage, creating it from the environment on first use."""
+    global _temp_mail_data
+    if _temp_mail_data is None:
+        _temp_mail_data = create_storage(
+            "temp_mail",
+            ttl=float(os.getenv("TEMP_MAIL_TTL", str(24 * 3600))),
+            maxsize=int(os.getenv("TEMP_MAIL_MAX_SESSIONS", "10000")),
+        )
+    return _temp_mail_data
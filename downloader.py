@@ -0,0 +1,156 @@
+import os
+from aiogram import types, Bot
+from aiogram.types import FSInputFile
+from utils import (
+    compress_video, MAX_SIZE,
+    parse_delivery_args, oversize_mode, split_video_stream_copy, send_video_parts
+)
+from ytdl_pool import extract_info, process_info
+from file_cache import send_from_cache, remember_sent, canonical_url
+from scheduler import job_slot
+from singleflight import deliver_once
+from metrics import record_error
+from progress import track_progress
+from workspace import job_workspace, projected_size, InsufficientSpace
+
+def escape_html(text: str) -> str:
+    """Escapes characters for HTML parsing."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+class VideoTooLarge(Exception):
+    """Raised when a video is still over MAX_SIZE after compression."""
+
+class Profile:
+    """
+    What differs between the link downloaders (/fb, /tik, /ig, /x, /pn, /tdl):
+    the yt-dlp options and cookie file for a platform, the texts shown to the
+    user and how the caption is built from the info dict.
+    """
+
+    def __init__(self, platform, usage, status_text, file_prefix, caption, ydl_opts=None,
+                 cookie_file=None, cookie_env=None, photos=False, strip_query=False, unsupported_hint=None):
+        self.platform = platform                  # file_cache platform and job key prefix
+        self.usage = usage                        # reply when the command has no URL
+        self.status_text = status_text            # status message while the job runs
+        self.file_prefix = file_prefix            # start of the job's file names
+        self.caption = caption                    # caption(info, url) -> HTML caption
+        self.ydl_opts = {'format': 'best'} if ydl_opts is None else ydl_opts
+        self.cookie_file = cookie_file
+        self.cookie_env = cookie_env              # environment variable that overrides cookie_file
+        self.photos = photos                      # entries without a duration are sent as photos
+        self.strip_query = strip_query            # drop the URL's query string
+        self.unsupported_hint = unsupported_hint  # reply when yt-dlp reports an unsupported URL
+
+    def options(self, outtmpl=None):
+        """The yt-dlp options for one job. Only the output template changes between jobs."""
+        ydl_opts = {'quiet': True, 'no_warnings': True, **self.ydl_opts}
+        if outtmpl:
+            ydl_opts['outtmpl'] = outtmpl
+        cookie_file = os.getenv(self.cookie_env, self.cookie_file) if self.cookie_env else self.cookie_file
+        # Only add cookies if the file exists
+        if cookie_file and os.path.exists(cookie_file):
+            ydl_opts['cookiefile'] = cookie_file
+        return ydl_opts
+
+async def fetch(profile: Profile, url: str):
+    """
+    Stage 1: extracts the media info in the yt-dlp worker pool without
+    downloading, so the job's size is known before it is admitted.
+    """
+    info, _ = await extract_info(url, profile.options(), download=False)
+    return info
+
+async def download(profile: Profile, info: dict, file_path_base: str, status_msg: types.Message):
+    """
+    Stage 2: downloads the extracted media to file_path_base.<ext>, showing
+    its progress in status_msg. Videos are given an .mp4 name.
+    Returns (info, file_path, is_photo).
+    """
+    with track_progress(status_msg, profile.status_text) as progress:
+        info, file_path = await process_info(info, profile.options(f"{file_path_base}.%(ext)s"), on_progress=progress.download)
+    is_photo = profile.photos and info.get('duration') is None
+    if not is_photo and not file_path.endswith('.mp4'):
+        new_path = f"{file_path_base}.mp4"
+        os.rename(file_path, new_path)
+        file_path = new_path
+    return info, file_path, is_photo
+
+async def fit(file_path: str, file_path_base: str, duration_seconds, mode: str, status_msg: types.Message):
+    """
+    Stage 3: returns the files to send for a video: the video itself if it is
+    small enough, otherwise its split parts or a compressed copy.
+    """
+    if os.path.getsize(file_path) <= MAX_SIZE:
+        return [file_path]
+
+    if mode == "split":
+        await status_msg.edit_text("Splitting video into parts... ✂️")
+        return await split_video_stream_copy(file_path, f"{file_path_base}_part", duration_seconds)
+
+    await status_msg.edit_text("Compressing video... 🎥")
+    compressed_path = f"{file_path_base}_compressed.mp4"
+    with track_progress(status_msg, "Compressing video... 🎥") as progress:
+        await compress_video(file_path, compressed_path, duration_seconds, on_progress=progress.encode)
+    if os.path.getsize(compressed_path) > MAX_SIZE:
+        raise VideoTooLarge("Sorry, this video is too long to be compressed under 50MB.")
+    return [compressed_path]
+
+async def send(bot: Bot, chat_id: int, paths: list, caption: str, is_photo: bool = False):
+    """Stage 4: uploads the files to the chat and returns the sent message(s)."""
+    if is_photo:
+        return await bot.send_photo(chat_id, photo=FSInputFile(paths[0]), caption=caption, parse_mode="HTML")
+    if len(paths) > 1:
+        return await send_video_parts(bot, chat_id, paths, caption)
+    return await bot.send_video(chat_id, video=FSInputFile(paths[0]), caption=caption, parse_mode="HTML", request_timeout=300)
+
+async def run_pipeline(profile: Profile, message: types.Message, bot: Bot):
+    """
+    Handles a downloader command from start to finish: answers from the
+    file_id cache when it can, otherwise queues one job per link for a
+    scheduler slot and runs fetch -> download -> fit -> send. Everything
+    from the download on happens in a workspace that is admitted for the
+    projected size and removed however the job ends.
+    """
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.reply(profile.usage)
+        return
+    url, requested_mode = parse_delivery_args(parts[1])
+    if profile.strip_query:
+        url = url.split('?')[0]
+
+    # Split parts and a compressed copy are different uploads, so the mode is part of the cache key
+    mode = oversize_mode(requested_mode)
+    if await send_from_cache(bot, message.chat.id, profile.platform, url, mode):
+        return
+
+    status_msg = await message.reply(profile.status_text)
+    base_filename = f"{profile.file_prefix}_{message.from_user.id}_{message.message_id}"
+    key = f"{profile.platform}|{canonical_url(url)}|{mode}"
+
+    async def download_and_send():
+        async with job_slot(message.from_user.id, status_msg):
+            try:
+                info = await fetch(profile, url)
+                async with job_workspace(base_filename, projected_size(info)) as workspace:
+                    file_path_base = workspace.path(base_filename)
+                    info, file_path, is_photo = await download(profile, info, file_path_base, status_msg)
+                    caption = profile.caption(info, url)
+                    paths = [file_path] if is_photo else await fit(file_path, file_path_base, info.get('duration', 0), mode, status_msg)
+                    sent = await send(bot, message.chat.id, paths, caption, is_photo)
+                entry = remember_sent(profile.platform, url, sent, caption, mode)
+                await status_msg.delete()
+                return entry
+            except (VideoTooLarge, InsufficientSpace) as e:
+                await status_msg.delete()
+                await message.reply(f"❌ {e}")
+            except Exception as e:
+                record_error(e)
+                await status_msg.delete()
+                safe_error_message = escape_html(str(e))
+                if profile.unsupported_hint and "Unsupported URL" in safe_error_message:
+                    await message.reply(profile.unsupported_hint)
+                else:
+                    await message.reply(f"❌ An error occurred:\n<code>{safe_error_message}</code>", parse_mode="HTML")
+
+    await deliver_once(key, download_and_send, bot, message.chat.id, status_msg)
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputMediaPhoto
+
+from utils import part_caption
+
+# Hosts that serve the same content under a different name
+HOST_ALIASES = {
+    "youtu.be": "youtube.com",
+    "vm.tiktok.com": "tiktok.com",
+    "x.com": "twitter.com",
+    "fb.watch": "facebook.com",
+    "threads.com": "threads.net",
+}
+
+# Query parameters that only track where a link was shared from. Every other parameter
+# may identify the content (v, list, fbid, story_fbid, id...), so it is kept.
+TRACKING_QUERY_PARAMS = {
+    "si", "feature", "t", "pp", "ab_channel",                  # YouTube
+    "igshid", "igsh",                                          # Instagram
+    "fbclid", "mibextid", "rdid", "share_url",                 # Facebook
+    "s", "ref_src", "ref_url",                                 # X
+    "is_from_webapp", "sender_device", "_r", "_t", "share_app_id", "share_link_id",  # TikTok
+    "gclid", "ref",
+}
+
+
+def canonical_url(url: str) -> str:
+    """
+    Reduces a URL to a stable form so that share variants of the same post
+    (mobile hosts, tracking parameters, youtu.be links...) map to one key.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m.", "mobile.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    path = parts.path.rstrip("/")
+    query = parse_qs(parts.query)
+
+    if host == "youtu.be":
+        query = {"v": [path.lstrip("/")]}
+        path = "/watch"
+    elif host == "youtube.com" and path.startswith("/shorts/"):
+        query = {"v": [path.split("/")[2]]}
+        path = "/watch"
+    host = HOST_ALIASES.get(host, host)
+
+    kept = {k: v[0] for k, v in sorted(query.items())
+            if k not in TRACKING_QUERY_PARAMS and not k.startswith("utm_")}
+    canonical = f"https://{host}{path}"
+    if kept:
+        canonical += "?" + urlencode(kept)
+    return canonical
+
+
+def sent_media(message):
+    """Returns (kind, file_id) for the media attached to a message the bot sent."""
+    if message.video:
+        return "video", message.video.file_id
+    if message.animation:
+        return "animation", message.animation.file_id
+    if message.audio:
+        return "audio", message.audio.file_id
+    if message.photo:
+        return "photo", message.photo[-1].file_id
+    if message.document:
+        return "document", message.document.file_id
+    return None, None
+
+
+class FileIdCache:
+    """
+    A small SQLite store mapping (platform, canonical URL, quality) to the
+    Telegram file_ids of media we already uploaded. Entries expire after
+    `ttl` seconds and the least recently used ones are evicted once the
+    store holds more than `max_entries`.
+    """
+
+    def __init__(self, path: str, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids ("
+            " key TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " file_ids TEXT NOT NULL,"
+            " caption TEXT,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS file_ids_last_used ON file_ids (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(platform: str, url: str, quality: str = "") -> str:
+        return f"{platform}|{canonical_url(url)}|{quality}"
+
+    def get(self, platform: str, url: str, quality: str = ""):
+        key = self.make_key(platform, url, quality)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT kind, file_ids, caption, created_at FROM file_ids WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            kind, file_ids, caption, created_at = row
+            if now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE file_ids SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return {"kind": kind, "file_ids": json.loads(file_ids), "caption": caption}
+
+    def put(self, platform: str, url: str, kind: str, file_ids: list, caption: str = None, quality: str = ""):
+        key = self.make_key(platform, url, quality)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_ids (key, kind, file_ids, caption, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(file_ids), caption, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def delete(self, platform: str, url: str, quality: str = ""):
+        with self._lock:
+            self._conn.execute("DELETE FROM file_ids WHERE key = ?", (self.make_key(platform, url, quality),))
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM file_ids WHERE created_at < ?", (now - self.ttl,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM file_ids").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM file_ids WHERE key IN"
+                " (SELECT key FROM file_ids ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+
+_cache = None
+
+
+def get_file_cache() -> FileIdCache:
+    """Returns the shared cache, creating it from the environment on first use."""
+    global _cache
+    if _cache is None:
+        _cache = FileIdCache(
+            path=os.getenv("FILE_CACHE_DB", "file_cache.sqlite3"),
+            ttl=int(os.getenv("FILE_CACHE_TTL", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("FILE_CACHE_MAX_ENTRIES", "20000")),
+        )
+    return _cache
+
+
+async def send_cached_media(bot: Bot, chat_id: int, entry: dict, caption: str = None):
+    """
+    Re-sends previously uploaded media by file_id. The caption goes on the
+    first item. Several photos are sent as one media group, several videos
+    are the parts of a split video and get their "Part i/N" labels back.
+    """
+    senders = {
+        "video": lambda file_id, **kw: bot.send_video(chat_id, video=file_id, **kw),
+        "animation": lambda file_id, **kw: bot.send_animation(chat_id, animation=file_id, **kw),
+        "audio": lambda file_id, **kw: bot.send_audio(chat_id, audio=file_id, **kw),
+        "photo": lambda file_id, **kw: bot.send_photo(chat_id, photo=file_id, **kw),
+        "document": lambda file_id, **kw: bot.send_document(chat_id, document=file_id, **kw),
+    }
+    caption = caption if caption is not None else entry["caption"]
+    if entry["kind"] == "photo" and 1 < len(entry["file_ids"]) <= 10:
+        # Photos that were delivered as an album go back out as one
+        await bot.send_media_group(chat_id, media=[
+            InputMediaPhoto(media=file_id, caption=caption if i == 0 else None)
+            for i, file_id in enumerate(entry["file_ids"])
+        ])
+        return
+    send = senders[entry["kind"]]
+    total = len(entry["file_ids"])
+    for i, file_id in enumerate(entry["file_ids"]):
+        if entry["kind"] == "video" and total > 1:
+            await send(file_id, caption=part_caption(caption, i + 1, total), parse_mode="HTML")
+        else:
+            await send(file_id, caption=caption if i == 0 else None)
+
+
+async def send_from_cache(bot: Bot, chat_id: int, platform: str, url: str, quality: str = "", caption_suffix: str = "") -> bool:
+    """
+    Sends the cached upload for this URL if we have one. Returns True when the
+    request was answered from the cache and the caller can skip the download.
+    """
+    cache = get_file_cache()
+    entry = cache.get(platform, url, quality)
+    if entry is None:
+        return False
+    caption = entry["caption"]
+    if caption_suffix:
+        caption = (caption or "") + caption_suffix
+    try:
+        await send_cached_media(bot, chat_id, entry, caption=caption)
+    except TelegramBadRequest as e:
+        # The file_id is no longer usable, so forget it and download again
+        logging.warning("Dropping stale cached file for %s: %s", url, e)
+        cache.delete(platform, url, quality)
+        return False
+    return True
+
+
+def remember_sent(platform: str, url: str, sent, caption: str = None, quality: str = ""):
+    """
+    Stores the file_ids of the message (or list of messages, for split videos)
+    we just sent so the next request can reuse them. Returns the cache entry,
+    or None if the messages carry no reusable media.
+    """
+    messages = sent if isinstance(sent, list) else [sent]
+    media = [sent_media(m) for m in messages]
+    kinds = {kind for kind, _ in media}
+    if len(kinds) != 1 or None in kinds:
+        return None
+    entry = {"kind": kinds.pop(), "file_ids": [file_id for _, file_id in media], "caption": caption}
+    get_file_cache().put(platform, url, entry["kind"], entry["file_ids"], caption, quality)
+    return entry
@@ -0,0 +1,236 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+# Requests that deliver a result are sent before status edits, deletes and chat actions
+PRIORITY_RESULT = 0
+PRIORITY_STATUS = 1
+
+# Edits of the same message that are still waiting are merged into the newest one
+COALESCED_METHODS = {"editMessageText", "editMessageCaption", "editMessageReplyMarkup"}
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average and bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token can be taken (0 if one is available now)."""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Hands out nothing for `seconds`, e.g. while Telegram's flood wait lasts."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class _Request:
+    """One outbound call waiting for its turn."""
+
+    def __init__(self, method, chat_id, priority, seq):
+        self.method = method
+        self.chat_id = chat_id
+        self.order = (priority, seq)
+        self.granted = None
+        self.done = asyncio.get_running_loop().create_future()
+        # Merged callers may never look at the outcome, so don't log it as unretrieved
+        self.done.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """
+    Paces every Bot API call that targets a chat so the bot stays under
+    Telegram's limits instead of running into flood waits:
+
+    - a global token bucket (FLOOD_GLOBAL_RATE, default 30 requests/s);
+    - one bucket per chat: FLOOD_CHAT_RATE (default 1/s) for private chats,
+      FLOOD_GROUP_RATE (default 20/min) for groups and channels, each with
+      bursts of FLOOD_BURST (default 3);
+    - waiting sends go before waiting edits and deletes, so results aren't
+      held up by status updates;
+    - an edit of a message that already has an edit waiting replaces it,
+      and both callers get the result of the one request;
+    - TelegramRetryAfter pauses the chat for retry_after seconds and the
+      request is retried (up to FLOOD_MAX_RETRIES times).
+
+    Calls without a chat_id (getUpdates, answerCallbackQuery...) pass straight through.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(float(os.getenv("FLOOD_GLOBAL_RATE", "30")),
+                                         float(os.getenv("FLOOD_GLOBAL_RATE", "30")))
+        self.chat_rate = float(os.getenv("FLOOD_CHAT_RATE", "1"))
+        self.group_rate = float(os.getenv("FLOOD_GROUP_RATE", str(20 / 60)))
+        self.burst = float(os.getenv("FLOOD_BURST", "3"))
+        self.max_retries = int(os.getenv("FLOOD_MAX_RETRIES", "3"))
+        self._buckets = {}   # chat id -> TokenBucket
+        self._waiting = []   # _Requests sorted by (priority, arrival)
+        self._edits = {}     # (chat id, message id, method) -> waiting edit request
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self.coalesced = 0
+        self.flood_waits = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        api_method = method.__api_method__
+        edit_key = None
+        if api_method in COALESCED_METHODS and getattr(method, "message_id", None) is not None:
+            edit_key = (chat_id, method.message_id, api_method)
+
+        while edit_key in self._edits:
+            # An edit of this message hasn't been sent yet: make it send ours instead
+            entry = self._edits[edit_key]
+            entry.method = method
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(entry.done)
+            except asyncio.CancelledError:
+                if not entry.done.cancelled():
+                    raise  # we were cancelled ourselves
+                # The caller that owned the request was cancelled: queue our own
+
+        priority = PRIORITY_RESULT if api_method.startswith("send") and api_method != "sendChatAction" else PRIORITY_STATUS
+        entry = _Request(method, chat_id, priority, next(self._seq))
+        if edit_key is not None:
+            self._edits[edit_key] = entry
+        try:
+            try:
+                await self._wait_turn(entry)
+            finally:
+                if edit_key is not None:
+                    # From here on newer edits must be sent after this one
+                    self._edits.pop(edit_key, None)
+            result = await self._send(make_request, bot, entry)
+        except asyncio.CancelledError:
+            entry.done.cancel()
+            raise
+        except BaseException as e:
+            entry.done.set_exception(e)
+            raise
+        entry.done.set_result(result)
+        return result
+
+    async def _send(self, make_request, bot, entry):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await make_request(bot, entry.method)
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                if attempt == self.max_retries:
+                    raise
+                logging.warning("Flood wait of %ss in chat %s, retrying %s",
+                                e.retry_after, entry.chat_id, entry.method.__api_method__)
+                # Everything else for this chat waits it out as well
+                self._bucket(entry.chat_id).pause(e.retry_after)
+                await self._wait_turn(entry)
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Private chats have positive ids, groups and channels negative ones
+            rate = self.chat_rate if isinstance(chat_id, int) and chat_id > 0 else self.group_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    async def _wait_turn(self, entry):
+        entry.granted = asyncio.get_running_loop().create_future()
+        index = len(self._waiting)
+        while index and self._waiting[index - 1].order > entry.order:
+            index -= 1
+        self._waiting.insert(index, entry)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+        try:
+            await entry.granted
+        finally:
+            if entry in self._waiting:
+                self._waiting.remove(entry)
+
+    async def _dispatch(self):
+        """Hands out turns, highest priority first, whenever both buckets have a token."""
+        while self._waiting:
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now)
+            if wait <= 0:
+                wait = self._grant_next(now)
+                if wait == 0:
+                    continue
+                self._forget_idle_chats(now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant_next(self, now):
+        """
+        Lets the first waiting request whose chat has a token go and returns 0,
+        or returns how long until one of them can (None if nobody is waiting).
+        """
+        wait = None
+        for entry in self._waiting:
+            if entry.granted.done():
+                continue
+            bucket = self._bucket(entry.chat_id)
+            delay = bucket.delay(now)
+            if delay <= 0:
+                self.global_bucket.take()
+                bucket.take()
+                self._waiting.remove(entry)
+                entry.granted.set_result(None)
+                return 0
+            wait = delay if wait is None else min(wait, delay)
+        return wait
+
+    def _forget_idle_chats(self, now):
+        if len(self._buckets) > 1000:
+            busy = {entry.chat_id for entry in self._waiting}
+            for chat_id in [c for c, b in self._buckets.items() if c not in busy and b.idle(now)]:
+                del self._buckets[chat_id]
+
+
+_flood_control = None
+
+
+def get_flood_control() -> FloodControlMiddleware:
+    """Returns the shared outbound limiter, created on first use."""
+    global _flood_control
+    if _flood_control is None:
+        _flood_control = FloodControlMiddleware()
+    return _flood_control
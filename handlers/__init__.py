@@ -1,6 +1,12 @@
+import os
+import time
+import inspect
+import logging
+import importlib
+from aiohttp import ClientSession
 from aiogram import Dispatcher, Bot, F
 from aiogram.filters import Command, CommandStart
-from functools import partial
+from aiogram.types import User
 
 # Callback Factories
 from keyboards.callbacks import YouTubeCallback, TempMailCallback
@@ -11,25 +17,62 @@ from .menu_handlers import (
     about_me_handler, policy_terms_handler, close_menu_handler,
     downloaders_menu_handler
 )
-# Social Media Downloaders
-from .youtube import handle_youtube, youtube_quality_callback
-from .youtube_audio import handle_youtube_audio
-from .facebook import handle_facebook
-from .tiktok import handle_tiktok
-from .instagram import handle_instagram
-from .twitter import handle_twitter
-from .pinterest import handle_pinterest
-from .threads import handle_threads
-from .spotify import handle_spotify
-
-# Utility Handlers
-from .qr_handler import handle_qr
-from .temp_mail_handler import get_temp_email, check_temp_inbox
-from .paste_handler import handle_paste
-from .ai_handler import handle_imagine
-
-
-def register_all_handlers(dp: Dispatcher, bot: Bot):
+
+# Every other handler module pulls in heavy dependencies (lxml, qrcode/PIL,
+# telegraph, the download stack...), so it is only imported when one of its
+# commands is first used. Import times are logged and kept in import_costs.
+import_costs = {}  # module name -> seconds spent importing it
+
+
+def load_handler_module(name: str):
+    """Imports handlers.<name>, logging how long the first import took."""
+    module_name = f"{__name__}.{name}"
+    if module_name not in import_costs:
+        started = time.perf_counter()
+        importlib.import_module(module_name)
+        import_costs[module_name] = time.perf_counter() - started
+        logging.info("Loaded %s in %.0f ms", module_name, import_costs[module_name] * 1000)
+    return importlib.import_module(module_name)
+
+
+def lazy(name: str, attr: str, **bound):
+    """
+    Returns a stand-in for handlers.<name>.<attr> that imports the module on
+    its first call. `bound` works like functools.partial. Like aiogram does for
+    real handlers, only the keyword arguments the handler accepts are passed on.
+    """
+    handler = None
+    accepted = None
+
+    async def stub(event, **kwargs):
+        nonlocal handler, accepted
+        if handler is None:
+            handler = getattr(load_handler_module(name), attr)
+            params = inspect.signature(handler).parameters.values()
+            if not any(p.kind is inspect.Parameter.VAR_KEYWORD for p in params):
+                accepted = {p.name for p in params}
+        kwargs.update(bound)
+        if accepted is not None:
+            kwargs = {k: v for k, v in kwargs.items() if k in accepted}
+        return await handler(event, **kwargs)
+
+    stub.__name__ = stub.__qualname__ = attr
+    return stub
+
+
+LAZY_MODULES = (
+    "youtube", "youtube_audio", "facebook", "tiktok", "instagram", "twitter", "pinterest",
+    "threads", "spotify", "qr_handler", "temp_mail_handler", "paste_handler", "ai_handler",
+)
+
+
+def preload_handlers():
+    """Imports every lazily registered handler module now, e.g. to warm up a worker before traffic."""
+    for name in LAZY_MODULES:
+        load_handler_module(name)
+
+
+def register_all_handlers(dp: Dispatcher, bot: Bot, http_session: ClientSession, bot_info: User):
 
     # Register Menu Handlers
     dp.message.register(start_handler, CommandStart())
@@ -41,22 +84,26 @@ def register_all_handlers(dp: Dispatcher, bot: Bot):
     dp.callback_query.register(downloaders_menu_handler, F.data == "downloaders_menu")
 
     # Register Downloader Handlers
-    dp.message.register(partial(handle_facebook, bot=bot), Command("fb"))
-    dp.message.register(partial(handle_pinterest, bot=bot), Command("pn"))
-    dp.message.register(partial(handle_instagram, bot=bot), Command("ig"))
-    dp.message.register(partial(handle_twitter, bot=bot), Command("x"))
-    dp.message.register(partial(handle_tiktok, bot=bot), Command("tik"))
-    dp.message.register(partial(handle_threads, bot=bot), Command("tdl"))
-    dp.message.register(partial(handle_spotify, bot=bot), Command("sp"))
-    dp.message.register(partial(handle_youtube, bot=bot), Command("yt"))
-    dp.message.register(partial(handle_youtube_audio, bot=bot), Command("song"))
+    dp.message.register(lazy("facebook", "handle_facebook", bot=bot), Command("fb"))
+    dp.message.register(lazy("pinterest", "handle_pinterest", bot=bot), Command("pn"))
+    dp.message.register(lazy("instagram", "handle_instagram", bot=bot), Command("ig"))
+    dp.message.register(lazy("twitter", "handle_twitter", bot=bot), Command("x"))
+    dp.message.register(lazy("tiktok", "handle_tiktok", bot=bot), Command("tik"))
+    dp.message.register(lazy("threads", "handle_threads", bot=bot), Command("tdl"))
+    dp.message.register(lazy("spotify", "handle_spotify", bot=bot, http_session=http_session), Command("sp"))
+    dp.message.register(lazy("youtube", "handle_youtube", bot=bot), Command("yt"))
+    dp.message.register(lazy("youtube_audio", "handle_youtube_audio", bot=bot), Command("song"))
 
     # Register Utility Handlers
-    dp.message.register(partial(handle_qr, bot=bot), Command("qr"))
-    dp.message.register(partial(get_temp_email, bot=bot), Command("get_email"))
-    dp.message.register(partial(handle_paste, bot=bot), Command("paste"))
-    dp.message.register(partial(handle_imagine, bot=bot), Command("imagine"))
+    dp.message.register(lazy("qr_handler", "handle_qr", bot=bot), Command("qr"))
+    dp.message.register(lazy("temp_mail_handler", "get_temp_email", bot=bot, http_session=http_session), Command("get_email"))
+    dp.message.register(lazy("paste_handler", "handle_paste", bot=bot, bot_username=bot_info.username), Command("paste"))
+    dp.message.register(lazy("ai_handler", "handle_imagine", bot=bot, http_session=http_session), Command("imagine"))
 
     # Register Callback Handlers
-    dp.callback_query.register(partial(youtube_quality_callback, bot=bot), YouTubeCallback.filter())
-    dp.callback_query.register(partial(check_temp_inbox, bot=bot), TempMailCallback.filter(F.action == "check"))
\ No newline at end of file
+    dp.callback_query.register(lazy("youtube", "youtube_quality_callback", bot=bot), YouTubeCallback.filter())
+    dp.callback_query.register(lazy("temp_mail_handler", "check_temp_inbox", bot=bot, http_session=http_session), TempMailCallback.filter(F.action == "check"))
+
+    # HANDLERS_PRELOAD=1 trades the faster start for no first-use delay
+    if os.getenv("HANDLERS_PRELOAD") == "1":
+        preload_handlers()
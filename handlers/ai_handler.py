@@ -1,7 +1,11 @@
 import os
-import asyncio
+import hashlib
 import aiohttp
 from aiogram import types, Bot
+from aiogram.types import InputMediaPhoto
+from metrics import record_error
+from horde import get_horde_poller
+from file_cache import send_from_cache, remember_sent
 
 def escape_html(text: str) -> str:
     """A simple function to escape basic HTML characters."""
@@ -9,65 +13,111 @@ def escape_html(text: str) -> str:
         return ""
     return text.replace("&", "&").replace("<", "<").replace(">", ">")
 
-async def handle_imagine(message: types.Message, bot: Bot):
+MODEL = "Anything V5"
+SIZE_RANGE = range(256, 1024 + 1, 64)
+
+def parse_imagine_args(text: str):
+    """
+    Splits "/imagine [-n COUNT] [--size WxH] prompt" into (prompt, count, width, height).
+    Raises ValueError with a message for the user when a flag is invalid.
+    """
+    max_images = int(os.getenv("HORDE_MAX_IMAGES", "4"))
+    tokens = text.split()[1:]
+    count, width, height = 1, 512, 512
+    words = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("-n", "--count") and i + 1 < len(tokens):
+            if not tokens[i + 1].isdigit() or not 1 <= int(tokens[i + 1]) <= max_images:
+                raise ValueError(f"The image count must be a number from 1 to {max_images}.")
+            count = int(tokens[i + 1])
+            i += 2
+        elif token == "--size" and i + 1 < len(tokens):
+            w, _, h = tokens[i + 1].lower().partition("x")
+            if not (w.isdigit() and h.isdigit() and int(w) in SIZE_RANGE and int(h) in SIZE_RANGE):
+                raise ValueError("The size must look like 512x768, with each side a multiple of 64 from 256 to 1024.")
+            width, height = int(w), int(h)
+            i += 2
+        else:
+            words.append(token)
+            i += 1
+    return " ".join(words), count, width, height
+
+def prompt_cache_url(prompt: str) -> str:
+    """The file_id cache key for a prompt. Case and spacing don't make a prompt different."""
+    digest = hashlib.sha256(f"{MODEL}|{' '.join(prompt.lower().split())}".encode()).hexdigest()
+    return f"https://stablehorde.net/prompt/{digest}"
+
+async def handle_imagine(message: types.Message, bot: Bot, http_session: aiohttp.ClientSession):
     """
     Handles the /imagine command by communicating directly with the Stable Horde API.
+    Several images are generated as one job and delivered as one album.
     """
-    prompt = message.text.replace("/imagine", "").strip()
+    try:
+        prompt, count, width, height = parse_imagine_args(message.text)
+    except ValueError as e:
+        await message.reply(f"❌ {e}")
+        return
 
     if not prompt:
-        await message.reply("Please provide a prompt after the command.\n<b>Example:</b> /imagine a beautiful castle in the clouds")
+        await message.reply("Please provide a prompt after the command.\n<b>Example:</b> /imagine a beautiful castle in the clouds\n"
+                            "Options: <code>-n 4</code> for several images, <code>--size 768x512</code> for another size.")
+        return
+
+    # Identical prompts with identical options are answered with the images we already sent
+    cache_url = prompt_cache_url(prompt)
+    options = f"{count}x{width}x{height}"
+    caption = f"✅ Here is your generated image for:\n<i>\"{escape_html(prompt)}\"</i>"
+    if await send_from_cache(bot, message.chat.id, "imagine", cache_url, quality=options):
         return
 
     status_msg = await message.reply(f"🎨 Sending prompt to the horde...\n<i>\"{escape_html(prompt)}\"</i>\n\nYour request is in the queue. This may take a few minutes.")
 
     api_key = os.getenv("STABLE_HORDE_API_KEY", "0000000000")
-    api_headers = {"apikey": api_key, "Client-Agent": "AIO_Bot:1.0:github.com/gemini/bot"}
+    client_agent = "AIO_Bot:1.0:github.com/gemini/bot"
     
     payload = {
         "prompt": prompt,
-        "params": {"n": 1, "width": 512, "height": 512},
-        "models": ["Anything V5"]
+        "params": {"n": count, "width": width, "height": height},
+        "models": [MODEL]
     }
 
+    async def show_progress(check: dict):
+        if check.get("processing"):
+            state = "Your image is being generated now"
+        else:
+            state = f"Position in the horde queue: <b>{check.get('queue_position', '?')}</b>"
+        await status_msg.edit_text(
+            f"🎨 <i>\"{escape_html(prompt)}\"</i>\n\n{state}\n"
+            f"⏳ Estimated wait: about {check.get('wait_time', 0)}s"
+        )
+
     try:
-        async with aiohttp.ClientSession() as session:
-            # 1. Submit the generation request
-            async with session.post('https://stablehorde.net/api/v2/generate/async', headers=api_headers, json=payload) as response:
-                if not response.ok:
-                    raise Exception(f"Failed to submit request: {await response.text()}")
-                job_data = await response.json()
-                job_id = job_data.get('id')
+        # 1. Submit the generation request
+        poller = get_horde_poller(http_session)
+        job_id = await poller.submit(payload, api_key, client_agent)
 
-            if not job_id:
-                raise Exception("Could not get a Job ID from the Horde.")
+        # 2. Wait for the result; the shared poller checks on the job and reports queue progress
+        final_data = await poller.wait(job_id, on_update=show_progress)
 
-            # 2. Poll for the result
-            while True:
-                await asyncio.sleep(10)
-                check_url = f'https://stablehorde.net/api/v2/generate/check/{job_id}'
-                async with session.get(check_url) as response:
-                    status_data = await response.json()
-                    if status_data.get('done'):
-                        break
-            
-            # 3. Retrieve the final image
-            status_url = f'https://stablehorde.net/api/v2/generate/status/{job_id}'
-            async with session.get(status_url) as response:
-                final_data = await response.json()
+        # 3. Send the final images
+        if final_data.get('generations'):
+            image_urls = [generation['img'] for generation in final_data['generations']]
 
-            if final_data.get('generations'):
-                image_url = final_data['generations'][0]['img']
-                
-                await bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=image_url,
-                    caption=f"✅ Here is your generated image for:\n<i>\"{escape_html(prompt)}\"</i>"
-                )
-                await status_msg.delete()
+            if len(image_urls) == 1:
+                sent = await bot.send_photo(chat_id=message.chat.id, photo=image_urls[0], caption=caption)
             else:
-                error_message = final_data.get('faulted', 'Job faulted or timed out.')
-                await status_msg.edit_text(f"❌ The horde could not generate an image. Reason: {escape_html(error_message)}")
+                sent = await bot.send_media_group(chat_id=message.chat.id, media=[
+                    InputMediaPhoto(media=url, caption=caption if i == 0 else None)
+                    for i, url in enumerate(image_urls)
+                ])
+            remember_sent("imagine", cache_url, sent, caption, quality=options)
+            await status_msg.delete()
+        else:
+            error_message = final_data.get('faulted', 'Job faulted or timed out.')
+            await status_msg.edit_text(f"❌ The horde could not generate an image. Reason: {escape_html(error_message)}")
 
     except Exception as e:
-        await status_msg.edit_text(f"❌ An error occurred: {escape_html(str(e))}")
\ No newline at end of file
+        record_error(e)
+        await status_msg.edit_text(f"❌ An error occurred: {escape_html(str(e))}")
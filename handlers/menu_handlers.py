@@ -85,7 +85,7 @@ Download videos and tracks from popular platforms using these commands:
 ➤ <b>/tdl [Video URL]</b> - Download a Threads video.
 - <i>Example:</i> /tdl https://www.threads.net/@user/post/example
 
-➤ <b>/sp [Track URL]</b> - Download a Spotify track.
+➤ <b>/sp [Track/Album/Playlist URL]</b> - Download a Spotify track, album or playlist.
 - <i>Example:</i> /sp https://open.spotify.com/track/example
 
 ➤ <b>/yt [Video URL]</b> - Download a YouTube video.
@@ -96,6 +96,7 @@ Download videos and tracks from popular platforms using these commands:
 
 <b>NOTE:</b>
 Provide a valid public URL for each platform to download successfully.
+Videos over 50MB are compressed. Add <b>--split</b> after the URL to get them in parts at full quality instead.
 """
     await callback.message.edit_text(text, reply_markup=get_downloader_menu_keyboard(), disable_web_page_preview=True)
     await callback.answer()
\ No newline at end of file
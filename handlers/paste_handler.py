@@ -1,57 +1,144 @@
+import io
+import os
+import json
+import asyncio
 from aiogram import types, Bot
 from telegraph.aio import Telegraph
+from telegraph.exceptions import RetryAfterError
+from metrics import record_error
+from data_storage import create_storage
 
-# Initialize the Telegraph client
-telegraph = Telegraph()
+# Telegraph rejects pages whose content is over 64 KB, so parts stay well below that
+PAGE_BYTES = 48 * 1024
 
-# A flag to ensure we only create the Telegraph account once per bot run
-account_created = False
+def max_pages() -> int:
+    """How many pages one paste may have (PASTE_MAX_PAGES). This is the only size limit."""
+    return int(os.getenv("PASTE_MAX_PAGES", "100"))
 
-async def create_telegraph_account(bot_username: str):
-    """Creates a new Telegraph account for the bot if one doesn't exist."""
-    global account_created
-    if not account_created:
-        await telegraph.create_account(
-            short_name='AIO Bot', # You can change this
-            author_name=bot_username,
-            author_url=f'https://t.me/{bot_username}'
-        )
-        account_created = True
+def too_long_error(limit: int) -> ValueError:
+    return ValueError(f"The text is too long to paste (max {limit} pages, about {limit * PAGE_BYTES / (1024 * 1024):.1f} MB).")
+
+# The Telegraph client, created once with the access token kept in storage across restarts
+telegraph = None
+_telegraph_lock = asyncio.Lock()
 
-async def handle_paste(message: types.Message, bot: Bot):
+async def get_telegraph(bot_username: str) -> Telegraph:
+    """Returns the bot's Telegraph client, creating the account only if no token was saved before."""
+    global telegraph
+    async with _telegraph_lock:
+        if telegraph is None:
+            storage = create_storage("telegraph")
+            token = storage.get("access_token")
+            client = Telegraph(access_token=token)
+            if token is None:
+                account = await client.create_account(
+                    short_name='AIO Bot', # You can change this
+                    author_name=bot_username,
+                    author_url=f'https://t.me/{bot_username}'
+                )
+                storage.set("access_token", account['access_token'])
+            telegraph = client
+    return telegraph
+
+def split_pages(text: str, page_bytes: int = PAGE_BYTES):
     """
-    Handles the /paste command to upload text to Telegraph.
+    Splits text into parts whose encoded page content fits in page_bytes,
+    cutting at line ends where possible.
     """
-    # Create an account for our bot on the first run
-    # We pass the bot's username to be used as the author name
-    me = await bot.get_me()
-    await create_telegraph_account(me.username)
-
-    # Determine which text to use
-    text_to_paste = ""
-    if message.reply_to_message and message.reply_to_message.text:
-        text_to_paste = message.reply_to_message.text
-    elif len(message.text.split(maxsplit=1)) > 1:
-        text_to_paste = message.text.split(maxsplit=1)[1]
-    else:
-        await message.reply(
-            "<b>Usage:</b>\n"
-            "➤ Reply to a message with <code>/paste</code>\n"
-            "➤ Or use <code>/paste your long text here...</code>"
-        )
-        return
+    pages, current, size = [], [], 0
+    for line in text.splitlines(keepends=True):
+        line_size = len(json.dumps(line, ensure_ascii=False).encode()) - 2
+        while line_size > page_bytes:
+            # A single huge line: cut it by characters (4 bytes each at worst, escaped at most 6)
+            cut = page_bytes // 6
+            line, head = line[cut:], line[:cut]
+            if current:
+                pages.append("".join(current))
+                current, size = [], 0
+            pages.append(head)
+            line_size = len(json.dumps(line, ensure_ascii=False).encode()) - 2
+        if size + line_size > page_bytes and current:
+            pages.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += line_size
+    if current:
+        pages.append("".join(current))
+    return pages
 
-    status_msg = await message.reply("Pasting to Telegraph... 📜")
+async def create_page(client: Telegraph, title: str, content: list, attempts: int = 3):
+    """Creates one page, waiting out Telegraph's flood control."""
+    for attempt in range(attempts):
+        try:
+            return await client.create_page(title=title, content=content)
+        except RetryAfterError as e:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(e.retry_after)
 
+async def read_paste_text(message: types.Message, bot: Bot):
+    """Returns the text to paste: a replied-to message or text file, or the text after the command."""
+    reply = message.reply_to_message
+    if reply and reply.text:
+        return reply.text
+    if reply and reply.document:
+        # A page never holds more than PAGE_BYTES of the file, so larger files can be refused before downloading
+        limit = max_pages()
+        if reply.document.file_size and reply.document.file_size > limit * PAGE_BYTES:
+            raise too_long_error(limit)
+        buffer = io.BytesIO()
+        await bot.download(reply.document, destination=buffer)
+        return buffer.getvalue().decode("utf-8", errors="replace")
+    if len(message.text.split(maxsplit=1)) > 1:
+        return message.text.split(maxsplit=1)[1]
+    return ""
+
+async def handle_paste(message: types.Message, bot: Bot, bot_username: str):
+    """
+    Handles the /paste command to upload text to Telegraph. Long texts are
+    split into parts that are created concurrently and listed on an index page.
+    """
+    status_msg = None
     try:
-        html_content = f"<pre>{text_to_paste}</pre>"
-        
-        response = await telegraph.create_page(
-            title='A Paste from AIO Bot', # You can change this title
-            html_content=html_content
-        )
-        
-        page_url = response['url']
+        # Determine which text to use
+        text_to_paste = await read_paste_text(message, bot)
+        if not text_to_paste:
+            await message.reply(
+                "<b>Usage:</b>\n"
+                "➤ Reply to a message or a text file with <code>/paste</code>\n"
+                "➤ Or use <code>/paste your long text here...</code>"
+            )
+            return
+
+        status_msg = await message.reply("Pasting to Telegraph... 📜")
+
+        # Our bot's account; its username is used as the author name
+        client = await get_telegraph(bot_username)
+        title = 'A Paste from AIO Bot' # You can change this title
+
+        # Content is passed as nodes, so the text needs no HTML escaping or parsing
+        parts = split_pages(text_to_paste)
+        limit = max_pages()
+        if len(parts) > limit:
+            raise too_long_error(limit)
+
+        if len(parts) == 1:
+            response = await create_page(client, title, [{'tag': 'pre', 'children': [parts[0]]}])
+            page_url = response['url']
+        else:
+            limiter = asyncio.Semaphore(int(os.getenv("PASTE_CONCURRENCY", "8")))
+
+            async def create_part(i, part):
+                async with limiter:
+                    return await create_page(client, f"{title} ({i}/{len(parts)})", [{'tag': 'pre', 'children': [part]}])
+
+            pages = await asyncio.gather(*(create_part(i, part) for i, part in enumerate(parts, start=1)))
+            index = [{'tag': 'p', 'children': [f"This paste is split into {len(pages)} parts:"]}, {'tag': 'ol', 'children': [
+                {'tag': 'li', 'children': [{'tag': 'a', 'attrs': {'href': page['url']}, 'children': [f"Part {i}"]}]}
+                for i, page in enumerate(pages, start=1)
+            ]}]
+            page_url = (await create_page(client, title, index))['url']
+
         await status_msg.edit_text(
             f"✅ Text has been pasted successfully!\n\n"
             f"🔗 <b>Link:</b> {page_url}",
@@ -59,4 +146,8 @@ async def handle_paste(message: types.Message, bot: Bot):
         )
 
     except Exception as e:
-        await status_msg.edit_text(f"❌ An error occurred: {e}")
\ No newline at end of file
+        record_error(e)
+        if status_msg is None:
+            await message.reply(f"❌ An error occurred: {e}")
+        else:
+            await status_msg.edit_text(f"❌ An error occurred: {e}")
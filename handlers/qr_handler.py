@@ -1,38 +1,142 @@
-import qrcode
+import os
 import io
+import asyncio
+import qrcode
+import qrcode.image.svg
+from qrcode.exceptions import DataOverflowError
 from aiogram import types, Bot
-from aiogram.types import BufferedInputFile
+from aiogram.types import BufferedInputFile, InputMediaPhoto, InputMediaDocument
+
+from cache import TTLCache
+
+# Output options, given as flags before the text
+QR_FLAGS = ("--svg", "--compact")
+# Telegram albums hold 2 to 10 items
+ALBUM_SIZE = 10
+
+# Rendered codes keyed by (text, format), so repeated payloads skip the encoder
+qr_cache = TTLCache(
+    maxsize=int(os.getenv("QR_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("QR_CACHE_TTL", str(24 * 3600))),
+)
 
 def escape_html(text: str) -> str:
     """Escapes characters for HTML parsing."""
-    return text.replace("&", "&").replace("<", "<").replace(">", ">")
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+def render_qr_png(text: str, compact: bool = False) -> bytes:
+    """Renders text as a QR code and returns the PNG bytes. Compact codes use smaller modules and margins."""
+    if compact:
+        qr_img = qrcode.make(text, box_size=4, border=2)
+    else:
+        qr_img = qrcode.make(text)
+    # Save the image to an in-memory buffer instead of a file
+    with io.BytesIO() as buffer:
+        qr_img.save(buffer, format="PNG", optimize=compact)
+        return buffer.getvalue()
+
+def render_qr_svg(text: str) -> bytes:
+    """Renders text as a QR code in SVG, which stays sharp at any print size."""
+    qr_img = qrcode.make(text, image_factory=qrcode.image.svg.SvgPathImage)
+    with io.BytesIO() as buffer:
+        qr_img.save(buffer)
+        return buffer.getvalue()
+
+async def render_qr(text: str, fmt: str) -> bytes:
+    """
+    Returns the code for text in 'png', 'compact' or 'svg' format, rendering
+    it in a worker thread on a cache miss. Raises DataOverflowError if the
+    text doesn't fit in a QR code.
+    """
+    data = qr_cache.get((text, fmt))
+    if data is None:
+        try:
+            if fmt == "svg":
+                data = await asyncio.to_thread(render_qr_svg, text)
+            else:
+                data = await asyncio.to_thread(render_qr_png, text, fmt == "compact")
+        except ValueError as e:
+            # Auto-sizing reports text past version 40 as an invalid version
+            raise DataOverflowError(str(e)) from e
+        qr_cache.set((text, fmt), data)
+    return data
+
+def album_chunks(items: list, size: int = ALBUM_SIZE) -> list:
+    """
+    Splits items into as few albums as possible with balanced sizes, so no
+    album is left with a single item (11 items give 6 + 5, not 10 + 1).
+    """
+    count = -(-len(items) // size)
+    base, extra = divmod(len(items), count)
+    chunks, start = [], 0
+    for i in range(count):
+        end = start + base + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+def parse_qr_args(text: str):
+    """Splits the text after /qr into (format, [payloads]). Each non-empty line is one code."""
+    parts = text.split(maxsplit=1)
+    body = parts[1] if len(parts) > 1 else ""
+    fmt = "png"
+    while True:
+        words = body.split(maxsplit=1)
+        if not words or words[0] not in QR_FLAGS:
+            break
+        fmt = words[0][2:]
+        body = words[1] if len(words) > 1 else ""
+    return fmt, [line.strip() for line in body.splitlines() if line.strip()]
 
 async def handle_qr(message: types.Message, bot: Bot):
     """
-    Handles the /qr command to generate a QR code.
+    Handles the /qr command to generate a QR code. Several lines give one
+    code per line, rendered in parallel and sent as an album.
     """
-    # Get the text to encode from the message, after the /qr command
-    text_to_encode = message.text.replace("/qr", "").strip()
+    fmt, payloads = parse_qr_args(message.text)
 
-    if not text_to_encode:
+    if not payloads:
         await message.reply("Please provide text or a link after the command.\n"
-                            "<b>Example:</b> /qr https://telegram.org")
+                            "<b>Example:</b> /qr https://telegram.org\n"
+                            "Put several lines in one message for several codes. "
+                            "Add <code>--compact</code> for a smaller image or <code>--svg</code> for a vector file.")
+        return
+
+    max_codes = int(os.getenv("QR_MAX_BATCH", "30"))
+    if len(payloads) > max_codes:
+        await message.reply(f"❌ Please send at most {max_codes} lines at a time.")
         return
 
-    # Generate the QR code image
-    qr_img = qrcode.make(text_to_encode)
+    results = await asyncio.gather(*(render_qr(payload, fmt) for payload in payloads), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, DataOverflowError):
+            raise result
+    # Payloads too long for the largest QR version are reported instead of rendered
+    too_long = [payload for payload, result in zip(payloads, results) if isinstance(result, DataOverflowError)]
+    rendered = [(payload, result) for payload, result in zip(payloads, results) if not isinstance(result, BaseException)]
+    if too_long:
+        await message.reply(f"❌ Skipped {len(too_long)} line(s) too long to fit in a QR code."
+                            if len(payloads) > 1 else "❌ This text is too long to fit in a QR code.")
+    if not rendered:
+        return
+    filename = "qr_code.svg" if fmt == "svg" else "qr_code.png"
 
-    # Save the image to an in-memory buffer instead of a file
-    with io.BytesIO() as buffer:
-        qr_img.save(buffer, format="PNG")
-        buffer.seek(0) # Go to the beginning of the buffer
-        
+    if len(rendered) == 1:
+        payload, data = rendered[0]
         # Create an object that aiogram can send
-        file_to_send = BufferedInputFile(buffer.getvalue(), filename="qr_code.png")
-
-        # Send the photo
-        await bot.send_photo(
-            chat_id=message.chat.id,
-            photo=file_to_send,
-            caption=f"✅ Here is the QR Code for:\n<code>{escape_html(text_to_encode)}</code>"
-        )
\ No newline at end of file
+        file_to_send = BufferedInputFile(data, filename=filename)
+        caption = f"✅ Here is the QR Code for:\n<code>{escape_html(payload)}</code>"
+        if fmt == "svg":
+            await bot.send_document(chat_id=message.chat.id, document=file_to_send, caption=caption)
+        else:
+            await bot.send_photo(chat_id=message.chat.id, photo=file_to_send, caption=caption)
+        return
+
+    # SVGs can't be shown as photos, so they go out as an album of documents
+    media_type = InputMediaDocument if fmt == "svg" else InputMediaPhoto
+    media = [
+        media_type(media=BufferedInputFile(data, filename=filename), caption=f"<code>{escape_html(payload)}</code>")
+        for payload, data in rendered
+    ]
+    for album in album_chunks(media):
+        await bot.send_media_group(chat_id=message.chat.id, media=album)
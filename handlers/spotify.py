@@ -1,85 +1,270 @@
 import os
+import time
+import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
 from aiogram import types, Bot
 from aiogram.types import FSInputFile
-from yt_dlp import YoutubeDL
-from utils import cleanup_files, format_duration
+from aiogram.exceptions import TelegramBadRequest
+from utils import format_duration
+from ytdl_pool import extract_info
+from file_cache import send_from_cache, send_cached_media, remember_sent, canonical_url
+from scheduler import job_slot, get_scheduler
+from singleflight import deliver_once, downloads
+from metrics import record_error
+from progress import track_progress
+from workspace import job_workspace, AUDIO_JOB_BYTES, InsufficientSpace
+from spotify_client import (
+    track_id_from_url, collection_from_url, track_url, fetch_page_metadata, get_track_cache, get_spotify_api
+)
 
 def escape_html(text: str) -> str:
     """Escapes characters for HTML parsing."""
     return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
-async def handle_spotify(message: types.Message, bot: Bot):
+def audio_dl_opts(base_filename: str) -> dict:
+    return {
+        'outtmpl': f'{base_filename}.%(ext)s',
+        'quiet': True,
+        'no_warnings': True,
+        'format': 'bestaudio/best',
+        'cookiefile': 'cookies.txt',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+    }
+
+async def download_track(track_id, search_title, base_filename, resolved=None, on_progress=None):
+    """
+    Downloads the YouTube match for a Spotify track as mp3. With a `resolved`
+    entry from the track cache the known video is fetched directly, otherwise
+    YouTube is searched for `search_title` and the match is remembered.
+    on_progress receives the worker's progress updates.
+    Returns (file_path, caption, audio_filename).
+    """
+    if resolved:
+        source = f"https://www.youtube.com/watch?v={resolved['video_id']}"
+    else:
+        source = f"ytsearch1:{search_title} official audio"
+
+    try:
+        info, _ = await extract_info(source, audio_dl_opts(base_filename), on_progress=on_progress)
+    except Exception:
+        if resolved:
+            # The video we matched before may be gone; search again next time
+            get_track_cache().delete(track_id)
+        raise
+    if 'entries' in info:
+        if not info['entries']:
+            raise ValueError("Could not find a matching song on YouTube.")
+        info = info['entries'][0]
+
+    yt_title = info.get('title', 'Unknown Title')
+    yt_artist = info.get('channel', 'Unknown Artist')
+    duration_sec = info.get('duration', 0)
+
+    if track_id and not resolved:
+        get_track_cache().set(track_id, {
+            'title': search_title,
+            'video_id': info['id'],
+            'yt_title': yt_title,
+            'artist': yt_artist,
+            'duration': duration_sec,
+        })
+
+    duration_formatted = format_duration(duration_sec)
+    caption = (f"🎵 <b>Title:</b> {escape_html(yt_title)}\n"
+               f"━━━━━━━━━━━━━━━━━━\n"
+               f"👤 <b>Artist:</b> {escape_html(yt_artist)}\n"
+               f"⏱ <b>Duration:</b> {duration_formatted}\n"
+               f"━━━━━━━━━━━━━━━━━━\n")
+    return f"{base_filename}.mp3", caption, f"{yt_artist} - {yt_title}.mp3"
+
+async def handle_spotify(message: types.Message, bot: Bot, http_session: aiohttp.ClientSession):
     parts = message.text.split(maxsplit=1)
     if len(parts) < 2:
-        await message.reply("Please provide a Spotify Track URL after the command.\nExample: /sp <spotify_track_url>")
+        await message.reply("Please provide a Spotify track, album or playlist URL after the command.\nExample: /sp <spotify_track_url>")
         return
     url = parts[1].strip()
 
+    # The cached caption leaves out the requester, who is added per user
+    downloaded_by = f"Downloaded By: {escape_html(message.from_user.full_name)}"
+
+    collection = collection_from_url(url)
+    if collection:
+        await handle_spotify_collection(message, bot, http_session, *collection, downloaded_by)
+        return
+
+    # Share links of the same track differ (intl paths, ?si=...), so key everything by track id
+    track_id = track_id_from_url(url)
+    cache_url = track_url(track_id) if track_id else url
+
+    if await send_from_cache(bot, message.chat.id, "spotify", cache_url, caption_suffix=downloaded_by):
+        return
+
     status_msg = await message.reply("Fetching Spotify track info... ℹ️")
 
-    try:
-        # Step 1: Scrape Spotify page to get the song title
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers={'User-Agent': 'Mozilla/5.0'}) as response:
-                if response.status != 200:
-                    raise ValueError(f"Spotify returned a non-200 status code: {response.status}")
-                html = await response.text()
-        
-        soup = BeautifulSoup(html, 'lxml')
-        title_tag = soup.find('title')
-        if not title_tag:
-            raise ValueError("Could not find the title of the song on the page.")
-            
-        page_title = title_tag.text.replace("| Spotify", "").strip()
-
-        await status_msg.edit_text(f"Found \"{page_title}\". Downloading from Spotify 𝟯𝟮𝟬 𝗞𝗕𝗣𝗦 (𝗢𝗴𝗴 𝗩𝗼𝗿𝗯𝗶𝘀) Quality... 🎵")
+    key = f"spotify|{canonical_url(cache_url)}"
+
+    async def download_and_send():
+        resolved = get_track_cache().get(track_id) if track_id else None
+        async with job_slot(message.from_user.id, status_msg):
+            try:
+                if resolved:
+                    # Resolved before: skip the Spotify page and the YouTube search
+                    page_title = resolved['title']
+                else:
+                    # Step 1: Read the Spotify page just far enough to get the song title
+                    metadata = await fetch_page_metadata(http_session, url)
+                    if not metadata.get('title'):
+                        raise ValueError("Could not find the title of the song on the page.")
+
+                    page_title = metadata['title'].replace("| Spotify", "").strip()
+
+                downloading_text = f"Found \"{page_title}\". Downloading from Spotify 𝟯𝟮𝟬 𝗞𝗕𝗣𝗦 (𝗢𝗴𝗴 𝗩𝗼𝗿𝗯𝗶𝘀) Quality... 🎵"
+                await status_msg.edit_text(downloading_text)
         
-        # Step 2: Use yt-dlp to search and download the song from YouTube
-        base_filename = f"spotify_{message.from_user.id}_{message.message_id}"
-        search_query = f"ytsearch1:{page_title} official audio"
-
-        audio_dl_opts = {
-            'outtmpl': f'{base_filename}.%(ext)s',
-            'quiet': True,
-            'no_warnings': True,
-            'format': 'bestaudio/best',
-            'cookiefile': 'cookies.txt',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-        }
-
-        with YoutubeDL(audio_dl_opts) as ydl:
-            info = ydl.extract_info(search_query, download=True)
-            if not info.get('entries'):
-                raise ValueError("Could not find a matching song on YouTube.")
-            
-            yt_title = info['entries'][0].get('title', 'Unknown Title')
-            yt_artist = info['entries'][0].get('channel', 'Unknown Artist')
-            duration_sec = info['entries'][0].get('duration', 0)
-            file_path = f"{base_filename}.mp3"
-
-        duration_formatted = format_duration(duration_sec)
-        caption = (f"🎵 <b>Title:</b> {escape_html(yt_title)}\n"
-                   f"━━━━━━━━━━━━━━━━━━\n"
-                   f"👤 <b>Artist:</b> {escape_html(yt_artist)}\n"
-                   f"⏱ <b>Duration:</b> {duration_formatted}\n"
-                   f"━━━━━━━━━━━━━━━━━━\n"
-                   f"Downloaded By: {escape_html(message.from_user.full_name)}")
-
-        audio_to_send = FSInputFile(file_path, filename=f"{yt_artist} - {yt_title}.mp3")
-        await bot.send_audio(
-            message.chat.id,
-            audio=audio_to_send,
-            caption=caption,
-            parse_mode="HTML"
+                # Step 2: Use yt-dlp to download the song from YouTube
+                base_filename = f"spotify_{message.from_user.id}_{message.message_id}"
+                async with job_workspace(base_filename, AUDIO_JOB_BYTES) as workspace:
+                    with track_progress(status_msg, downloading_text) as progress:
+                        file_path, caption, audio_name = await download_track(
+                            track_id, page_title, workspace.path(base_filename), resolved, on_progress=progress.download
+                        )
+
+                    audio_to_send = FSInputFile(file_path, filename=audio_name)
+                    sent = await bot.send_audio(
+                        message.chat.id,
+                        audio=audio_to_send,
+                        caption=caption + downloaded_by,
+                        parse_mode="HTML"
+                    )
+                entry = remember_sent("spotify", cache_url, sent, caption)
+                await status_msg.delete()
+                return entry
+            except InsufficientSpace as e:
+                await status_msg.delete()
+                await message.reply(f"❌ {e}")
+            except Exception as e:
+                record_error(e)
+                await status_msg.delete()
+                await message.reply(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>", parse_mode="HTML")
+
+    await deliver_once(key, download_and_send, bot, message.chat.id, status_msg, caption_suffix=downloaded_by)
+
+class BatchProgress:
+    """
+    The single status message of an album/playlist download. Edits are
+    throttled to one every `interval` seconds, except for the final one.
+    """
+
+    def __init__(self, status_msg: types.Message, title: str, total: int, interval: float = 3.0):
+        self.status_msg = status_msg
+        self.title = title
+        self.total = total
+        self.interval = interval
+        self.sent = 0
+        self.failed = []
+        self._last_edit = 0.0
+
+    async def update(self, final: bool = False):
+        now = time.monotonic()
+        if not final and now - self._last_edit < self.interval:
+            return
+        self._last_edit = now
+
+        text = f"📀 <b>{escape_html(self.title)}</b>\n"
+        if final:
+            text += f"✅ Sent {self.sent} of {self.total} tracks."
+        else:
+            text += f"Downloading... {self.sent + len(self.failed)}/{self.total} done 🎵"
+        if self.failed:
+            text += f"\n❌ Failed ({len(self.failed)}): " + escape_html(", ".join(self.failed[:10]))
+            if len(self.failed) > 10:
+                text += ", ..."
+        try:
+            await self.status_msg.edit_text(text)
+        except TelegramBadRequest:
+            pass  # e.g. the text didn't change
+
+async def deliver_track(bot: Bot, chat_id: int, user_id: int, track: dict, base_filename: str, downloaded_by: str):
+    """
+    Sends one track of an album or playlist: from the file_id cache if we
+    have it, otherwise downloaded once even if other requests want it too.
+    Each download is its own job in the fair scheduler, so a batch is held
+    to the same per-user and global limits as single downloads.
+    """
+    cache_url = track_url(track['id'])
+    if await send_from_cache(bot, chat_id, "spotify", cache_url, caption_suffix=downloaded_by):
+        return
+
+    async def download_and_send():
+        resolved = get_track_cache().get(track['id'])
+        search_title = resolved['title'] if resolved else f"{track['name']} - {track['artists']}"
+        try:
+            # No status message: the batch's progress message stays as it is while tracks queue
+            async with get_scheduler().slot(user_id), job_workspace(base_filename, AUDIO_JOB_BYTES) as workspace:
+                file_path, caption, audio_name = await download_track(
+                    track['id'], search_title, workspace.path(base_filename), resolved
+                )
+                sent = await bot.send_audio(
+                    chat_id,
+                    audio=FSInputFile(file_path, filename=audio_name),
+                    caption=caption + downloaded_by,
+                    parse_mode="HTML"
+                )
+            return remember_sent("spotify", cache_url, sent, caption)
+        except Exception as e:
+            record_error(e)
+            return None
+
+    entry, shared = await downloads.do(f"spotify|{canonical_url(cache_url)}", download_and_send)
+    if entry is None:
+        raise ValueError(f"Could not download {track['name']}.")
+    if shared:
+        await send_cached_media(bot, chat_id, entry, caption=(entry['caption'] or "") + downloaded_by)
+
+async def handle_spotify_collection(message: types.Message, bot: Bot, http_session: aiohttp.ClientSession,
+                                    kind: str, collection_id: str, downloaded_by: str):
+    """
+    Downloads every track of an album or playlist. Tracks go through the
+    pipeline SPOTIFY_BATCH_CONCURRENCY at a time (if the scheduler has slots
+    for them) and each one is sent as soon as it is ready, so the whole batch
+    takes about (tracks / concurrency) downloads instead of one per track.
+    """
+    api = get_spotify_api()
+    if api is None:
+        await message.reply("❌ Albums and playlists are not available on this bot yet. Please send individual track links.")
+        return
+
+    status_msg = await message.reply(f"Fetching Spotify {kind}... ℹ️")
+    try:
+        title, tracks = await api.collection_tracks(
+            http_session, kind, collection_id, limit=int(os.getenv("SPOTIFY_MAX_TRACKS", "50"))
         )
-        await status_msg.delete()
-        cleanup_files(file_path)
     except Exception as e:
-        await status_msg.delete()
-        await message.reply(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>\n\nNote: Only individual tracks are supported.", parse_mode="HTML")
\ No newline at end of file
+        record_error(e)
+        await status_msg.edit_text(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>")
+        return
+    if not tracks:
+        await status_msg.edit_text(f"❌ This {kind} has no downloadable tracks.")
+        return
+
+    progress = BatchProgress(status_msg, title, len(tracks))
+    limiter = asyncio.Semaphore(int(os.getenv("SPOTIFY_BATCH_CONCURRENCY", "3")))
+
+    async def run(index, track):
+        async with limiter:
+            base_filename = f"spotify_{message.from_user.id}_{message.message_id}_{index}"
+            try:
+                await deliver_track(bot, message.chat.id, message.from_user.id, track, base_filename, downloaded_by)
+                progress.sent += 1
+            except Exception as e:
+                record_error(e)
+                progress.failed.append(track['name'])
+            await progress.update()
+
+    await progress.update()
+    await asyncio.gather(*(run(i, track) for i, track in enumerate(tracks)))
+    await progress.update(final=True)
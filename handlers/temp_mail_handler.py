@@ -1,14 +1,17 @@
+import asyncio
 import aiohttp
 import random
 import string
 import uuid
 import re
+import threading
 from aiogram import types, Bot
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from bs4 import BeautifulSoup
+from lxml import etree
 
 from keyboards.callbacks import TempMailCallback
-from data_storage import temp_mail_data
+from data_storage import get_temp_mail_storage
+from metrics import record_error
 
 API_BASE = "https://api.mail.tm"
 
@@ -16,76 +19,108 @@ def escape_html(text: str) -> str:
     """Escapes characters for HTML parsing."""
     return text.replace("&", "&").replace("<", "<").replace(">", ">")
 
-# --- NEW: OTP and Link Extractor ---
+# --- OTP and Link Extractor ---
+# Common OTP patterns: 6-digit numbers, often near words like "code", "token", "password".
+OTP_PATTERNS = [
+    re.compile(r'(\b\d{6}\b)'), # 6-digit number
+    re.compile(r'code is:\s*(\d+)', re.IGNORECASE),
+    re.compile(r'verification code:\s*(\d+)', re.IGNORECASE),
+    re.compile(r'security code:\s*(\w+)', re.IGNORECASE),
+]
+LINK_KEYWORDS = ('verify', 'confirm', 'activate', 'validate', 'complete')
+
+# Bodies larger than this are parsed in a worker thread instead of on the event loop
+LARGE_BODY_CHARS = 64 * 1024
+
+# Parsers are reused, but lxml serialises access to a parser, so each thread gets its own.
+# Otherwise a small parse on the event loop would wait behind a large one in a worker thread.
+_parsers = threading.local()
+
+def _html_parsers():
+    """Returns this thread's (str, utf-8 bytes) parsers: lenient HTML, comments dropped while parsing."""
+    if not hasattr(_parsers, 'html'):
+        _parsers.html = etree.HTMLParser(remove_comments=True, remove_pis=True)
+        _parsers.utf8 = etree.HTMLParser(remove_comments=True, remove_pis=True, encoding='utf-8')
+    return _parsers.html, _parsers.utf8
+
 def extract_otp_and_links(html_content: str) -> dict:
     """
     Scans HTML content to find OTPs (One-Time Passwords) and verification links.
     """
-    if not html_content:
+    if not html_content or not html_content.strip():
         return {'otps': [], 'links': []}
 
-    soup = BeautifulSoup(html_content, 'html.parser')
-    text = soup.get_text(separator=' ')
+    html_parser, utf8_html_parser = _html_parsers()
+    try:
+        root = etree.fromstring(html_content, html_parser)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        root = etree.fromstring(html_content.encode('utf-8'), utf8_html_parser)
+    if root is None:
+        return {'otps': [], 'links': []}
+    # Scripts and styles aren't visible text (and CSS colours look like 6-digit codes)
+    etree.strip_elements(root, 'script', 'style', with_tail=False)
+    text = ' '.join(root.itertext())
     
     # --- Find OTPs ---
-    # Common OTP patterns: 6-digit numbers, often near words like "code", "token", "password".
-    otp_patterns = [
-        r'(\b\d{6}\b)', # 6-digit number
-        r'code is:\s*(\d+)',
-        r'verification code:\s*(\d+)',
-        r'security code:\s*(\w+)'
-    ]
-    otps = []
-    for pattern in otp_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
-            if match not in otps:
-                otps.append(match)
+    # A dict keeps the first-seen order and makes the duplicate check O(1)
+    otps = {}
+    for pattern in OTP_PATTERNS:
+        for match in pattern.findall(text):
+            otps[match] = None
 
     # --- Find Verification Links ---
     verification_links = []
-    link_keywords = ['verify', 'confirm', 'activate', 'validate', 'complete']
-    for a in soup.find_all('a', href=True):
-        link_text = a.get_text().lower()
+    for a in root.iter('a'):
+        href = a.get('href')
+        if href is None:
+            continue
+        parts = list(a.itertext())
+        link_text = ''.join(parts).lower()
         # Check if any keyword is in the link's text
-        if any(keyword in link_text for keyword in link_keywords):
-            verification_links.append({'text': a.get_text(strip=True), 'href': a['href']})
+        if any(keyword in link_text for keyword in LINK_KEYWORDS):
+            verification_links.append({'text': ''.join(part.strip() for part in parts), 'href': href})
     
-    return {'otps': otps, 'links': verification_links}
+    return {'otps': list(otps), 'links': verification_links}
+
+async def extract_otp_and_links_async(html_content: str) -> dict:
+    """Runs extract_otp_and_links, moving large bodies off the event loop."""
+    if html_content and len(html_content) > LARGE_BODY_CHARS:
+        return await asyncio.to_thread(extract_otp_and_links, html_content)
+    return extract_otp_and_links(html_content)
 
 
 # Handler for the /get_email command
-async def get_temp_email(message: types.Message, bot: Bot):
+async def get_temp_email(message: types.Message, bot: Bot, http_session: aiohttp.ClientSession):
     """
     Generates a new temporary email address from Mail.tm.
     """
     status_msg = await message.reply("Creating your temporary email... 📧")
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{API_BASE}/domains") as response:
-                if not response.ok:
-                    raise ConnectionError("Could not fetch domains.")
-                domains = await response.json()
-                domain = domains['hydra:member'][0]['domain']
-
-            username = ''.join(random.choices(string.ascii_lowercase + string.digits, k=12))
-            password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-            address = f"{username}@{domain}"
-
-            account_payload = {"address": address, "password": password}
-            async with session.post(f"{API_BASE}/accounts", json=account_payload) as response:
-                if not response.status == 201:
-                    raise ConnectionError(f"Could not create account.")
-
-            token_payload = {"address": address, "password": password}
-            async with session.post(f"{API_BASE}/token", json=token_payload) as response:
-                if not response.ok:
-                    raise ConnectionError("Could not get authentication token.")
-                token_data = await response.json()
-                token = token_data['token']
+        async with http_session.get(f"{API_BASE}/domains") as response:
+            if not response.ok:
+                raise ConnectionError("Could not fetch domains.")
+            domains = await response.json()
+            domain = domains['hydra:member'][0]['domain']
+
+        username = ''.join(random.choices(string.ascii_lowercase + string.digits, k=12))
+        password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+        address = f"{username}@{domain}"
+
+        account_payload = {"address": address, "password": password}
+        async with http_session.post(f"{API_BASE}/accounts", json=account_payload) as response:
+            if not response.status == 201:
+                raise ConnectionError(f"Could not create account.")
+
+        token_payload = {"address": address, "password": password}
+        async with http_session.post(f"{API_BASE}/token", json=token_payload) as response:
+            if not response.ok:
+                raise ConnectionError("Could not get authentication token.")
+            token_data = await response.json()
+            token = token_data['token']
 
         session_id = str(uuid.uuid4())
-        temp_mail_data[session_id] = {'token': token, 'address': address}
+        get_temp_mail_storage().set(session_id, {'token': token, 'address': address})
 
         builder = InlineKeyboardBuilder()
         check_inbox_callback = TempMailCallback(action="check", session_id=session_id).pack()
@@ -98,82 +133,126 @@ async def get_temp_email(message: types.Message, bot: Bot):
             reply_markup=builder.as_markup()
         )
     except Exception as e:
+        record_error(e)
         await status_msg.edit_text(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>")
 
 
+# How many full messages are fetched from Mail.tm at the same time
+MAX_PARALLEL_FETCHES = 5
+# How many message ids and extraction results are remembered per session
+MAX_TRACKED_MESSAGES = 100
+
+def format_inbox_message(msg_preview: dict, extracted_data: dict) -> str:
+    """Builds the chat message that shows one email's OTPs and verification links."""
+    from_email = escape_html(msg_preview['from']['address'])
+    subject = escape_html(msg_preview.get('subject', 'N/A'))
+    
+    response_text = (
+        f"<b>From:</b> {from_email}\n"
+        f"<b>Subject:</b> {subject}\n"
+        f"━━━━━━━━━━━━━━━━━━\n"
+    )
+
+    # --- Format the extracted data ---
+    if not extracted_data['otps'] and not extracted_data['links']:
+        response_text += "<i>No specific OTP or verification link found. Check the full email manually if needed.</i>"
+    else:
+        if extracted_data['otps']:
+            response_text += "🔑 <b>OTP/Code Found:</b>\n"
+            for otp in extracted_data['otps']:
+                response_text += f"<code>{otp}</code>\n"
+            response_text += "\n"
+
+        if extracted_data['links']:
+            response_text += "🔗 <b>Verification Link(s) Found:</b>\n"
+            for link in extracted_data['links']:
+                response_text += f'➤ <a href="{link["href"]}">{link["text"]}</a>\n'
+    return response_text
+
+async def fetch_extracted(http_session: aiohttp.ClientSession, headers: dict, msg_id: str, limiter: asyncio.Semaphore):
+    """Fetches one full message and extracts its OTPs and links. Returns None if the fetch failed."""
+    async with limiter:
+        async with http_session.get(f"{API_BASE}/messages/{msg_id}", headers=headers) as msg_response:
+            if not msg_response.ok:
+                return None
+            full_msg = await msg_response.json()
+    html_body = (full_msg.get('html') or [''])[0]
+    return await extract_otp_and_links_async(html_body)
+
 # Handler for the "Check Inbox" button callback
-async def check_temp_inbox(callback: types.CallbackQuery, bot: Bot):
+async def check_temp_inbox(callback: types.CallbackQuery, bot: Bot, http_session: aiohttp.ClientSession):
     """
-    Checks the inbox and extracts only OTPs and verification links.
+    Checks the inbox and extracts only OTPs and verification links. Only
+    messages that haven't been shown yet are fetched and shown. The query is
+    answered once, when the outcome is known, since Telegram takes only one answer.
     """
-    await callback.answer("Checking inbox...")
-    
     callback_data = TempMailCallback.unpack(callback.data)
     session_id = callback_data.session_id
     
-    session_data = temp_mail_data.get(session_id)
+    storage = get_temp_mail_storage()
+    session_data = storage.get(session_id)
     if not session_data:
+        await callback.answer()
         await callback.message.answer("❌ This email session has expired or is invalid. Please get a new one with /get_email.")
         return
         
     token = session_data['token']
     address = session_data['address']
+    # Ids of messages already shown, and what was extracted from them
+    seen_ids = session_data.get('seen', [])
+    extracted_cache = session_data.get('extracted', {})
+    answered = False
     
     try:
         headers = {'Authorization': f'Bearer {token}'}
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.get(f"{API_BASE}/messages") as response:
-                if not response.ok:
-                    raise ConnectionError("Failed to fetch messages.")
-                messages = await response.json()
-        
-            inbox = messages.get('hydra:member', [])
-            if not inbox:
-                await callback.answer("📭 Your inbox is empty.", show_alert=True)
-                return
-                
-            await callback.message.answer(f"📬 Found {len(inbox)} message(s) for <b>{address}</b>:")
-
-            for msg_preview in inbox:
-                msg_id = msg_preview.get('id')
-                if not msg_id:
-                    continue
-                
-                # Fetch the full message content
-                async with session.get(f"{API_BASE}/messages/{msg_id}") as msg_response:
-                    if msg_response.ok:
-                        full_msg = await msg_response.json()
-                        html_body = (full_msg.get('html') or [''])[0]
-                        # --- USE THE NEW EXTRACTOR ---
-                        extracted_data = extract_otp_and_links(html_body)
-                    else:
-                        extracted_data = {'otps': [], 'links': []}
-                
-                from_email = escape_html(msg_preview['from']['address'])
-                subject = escape_html(msg_preview.get('subject', 'N/A'))
-                
-                response_text = (
-                    f"<b>From:</b> {from_email}\n"
-                    f"<b>Subject:</b> {subject}\n"
-                    f"━━━━━━━━━━━━━━━━━━\n"
-                )
-
-                # --- Format the extracted data ---
-                if not extracted_data['otps'] and not extracted_data['links']:
-                    response_text += "<i>No specific OTP or verification link found. Check the full email manually if needed.</i>"
-                else:
-                    if extracted_data['otps']:
-                        response_text += "🔑 <b>OTP/Code Found:</b>\n"
-                        for otp in extracted_data['otps']:
-                            response_text += f"<code>{otp}</code>\n"
-                        response_text += "\n"
-
-                    if extracted_data['links']:
-                        response_text += "🔗 <b>Verification Link(s) Found:</b>\n"
-                        for link in extracted_data['links']:
-                            response_text += f'➤ <a href="{link["href"]}">{link["text"]}</a>\n'
-
-                await callback.message.answer(response_text, parse_mode="HTML", disable_web_page_preview=True)
+        async with http_session.get(f"{API_BASE}/messages", headers=headers) as response:
+            if not response.ok:
+                raise ConnectionError("Failed to fetch messages.")
+            messages = await response.json()
+
+        inbox = messages.get('hydra:member', [])
+        if not inbox:
+            answered = True
+            await callback.answer("📭 Your inbox is empty.", show_alert=True)
+            return
+
+        inbox = [m for m in inbox if m.get('id')]
+        seen = set(seen_ids)
+        new_messages = [m for m in inbox if m['id'] not in seen]
+        if not new_messages:
+            answered = True
+            await callback.answer("📭 No new messages since your last check.", show_alert=True)
+            return
+        answered = True
+        await callback.answer("Checking inbox...")
+
+        # Fetch only the bodies we haven't extracted before, a few at a time
+        to_fetch = [m for m in new_messages if m['id'] not in extracted_cache]
+        limiter = asyncio.Semaphore(MAX_PARALLEL_FETCHES)
+        fetched = await asyncio.gather(*(
+            fetch_extracted(http_session, headers, m['id'], limiter) for m in to_fetch
+        ))
+
+        for msg_preview, extracted_data in zip(to_fetch, fetched):
+            # Failed fetches aren't remembered, so the next check retries them
+            if extracted_data is not None:
+                extracted_cache[msg_preview['id']] = extracted_data
+        seen_ids = [msg_id for msg_id in seen_ids if msg_id in extracted_cache]
+        seen_ids += [m['id'] for m in new_messages if m['id'] in extracted_cache]
+        seen_ids = seen_ids[-MAX_TRACKED_MESSAGES:]
+        session_data['seen'] = seen_ids
+        session_data['extracted'] = {msg_id: extracted_cache[msg_id] for msg_id in seen_ids}
+        storage.set(session_id, session_data)
+
+        await callback.message.answer(f"📬 Found {len(new_messages)} new message(s) for <b>{address}</b>:")
+
+        for msg_preview in new_messages:
+            extracted_data = extracted_cache.get(msg_preview['id'], {'otps': [], 'links': []})
+            response_text = format_inbox_message(msg_preview, extracted_data)
+            await callback.message.answer(response_text, parse_mode="HTML", disable_web_page_preview=True)
 
     except Exception as e:
-        await callback.message.answer(f"❌ An error occurred while checking the inbox:\n<code>{escape_html(str(e))}</code>")
\ No newline at end of file
+        record_error(e)
+        if not answered:
+            await callback.answer()
+        await callback.message.answer(f"❌ An error occurred while checking the inbox:\n<code>{escape_html(str(e))}</code>")
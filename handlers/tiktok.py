@@ -1,62 +1,23 @@
-import os
 from aiogram import types, Bot
-from aiogram.types import FSInputFile
-from yt_dlp import YoutubeDL
-from utils import format_duration, compress_video_to_target_size, cleanup_files, MAX_SIZE
+from utils import format_duration
+from downloader import Profile, run_pipeline
 
 def escape_html(text: str) -> str:
     """Escapes characters for HTML parsing."""
     return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
 
-async def handle_tiktok(message: types.Message, bot: Bot):
-    parts = message.text.split(maxsplit=1)
-    if len(parts) < 2:
-        await message.reply("Please provide a TikTok URL after the command.\nExample: /tik https://tiktok.com/@user/video/example")
-        return
-    url = parts[1].strip()
-
-    status_msg = await message.reply("Downloading TikTok video... 🔄")
-    base_filename = f"tt_video_{message.from_user.id}_{message.message_id}"
-    ydl_opts = {'outtmpl': f'{base_filename}.%(ext)s', 'format': 'best', 'quiet': True, 'no_warnings': True}
-
-    try:
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            file_path = ydl.prepare_filename(info)
-            if not file_path.endswith('.mp4'):
-                new_path = f"{base_filename}.mp4"
-                os.rename(file_path, new_path)
-                file_path = new_path
+def build_caption(info: dict, url: str) -> str:
+    title = info.get('title', 'TikTok Video')
+    if len(title) > 250: title = title[:250] + '...'
+    return f"🎵 <b>{escape_html(title)}</b>\n⏱ <b>Duration:</b> {format_duration(info.get('duration', 0))}"
 
-        title = info.get('title', 'TikTok Video')
-        if len(title) > 250: title = title[:250] + '...'
-            
-        duration_seconds = info.get('duration', 0)
+PROFILE = Profile(
+    platform="tiktok",
+    usage="Please provide a TikTok URL after the command.\nExample: /tik https://tiktok.com/@user/video/example",
+    status_text="Downloading TikTok video... 🔄",
+    file_prefix="tt_video",
+    caption=build_caption,
+)
 
-        caption = f"🎵 <b>{escape_html(title)}</b>\n⏱ <b>Duration:</b> {format_duration(duration_seconds)}"
-        
-        file_size = os.path.getsize(file_path)
-        if file_size > MAX_SIZE:
-            await status_msg.edit_text("Compressing video... 🎥")
-            compressed_path = f"{base_filename}_compressed.mp4"
-            compress_video_to_target_size(file_path, compressed_path, duration_seconds)
-
-            if os.path.getsize(compressed_path) > MAX_SIZE:
-                await status_msg.delete()
-                await message.reply("❌ Sorry, this video is too long to be compressed under 50MB.")
-                cleanup_files(file_path, compressed_path)
-                return
-            
-            video_to_send = FSInputFile(compressed_path)
-            await bot.send_video(message.chat.id, video=video_to_send, caption=caption, parse_mode="HTML", request_timeout=300)
-            cleanup_files(file_path, compressed_path)
-        else:
-            video_to_send = FSInputFile(file_path)
-            await bot.send_video(message.chat.id, video=video_to_send, caption=caption, parse_mode="HTML", request_timeout=300)
-            cleanup_files(file_path)
-
-        await status_msg.delete()
-    except Exception as e:
-        await status_msg.delete()
-        await message.reply(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>", parse_mode="HTML")
-        cleanup_files(f"{base_filename}.mp4", f"{base_filename}_compressed.mp4")
\ No newline at end of file
+async def handle_tiktok(message: types.Message, bot: Bot):
+    await run_pipeline(PROFILE, message, bot)
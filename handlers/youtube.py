@@ -1,16 +1,69 @@
 import os
-import yt_dlp
+from urllib.parse import urlsplit, parse_qs
 from aiogram import types, Bot
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from utils import format_duration, compress_video_to_target_size, cleanup_files, MAX_SIZE
+from utils import (
+    format_duration, compress_video, MAX_SIZE,
+    parse_delivery_args, oversize_mode, split_video_stream_copy, send_video_parts
+)
 from keyboards.callbacks import YouTubeCallback
+from ytdl_pool import extract_info, process_info, YtdlJobError
+from file_cache import send_from_cache, remember_sent, canonical_url
+from scheduler import job_slot
+from singleflight import deliver_once
+from cache import TTLCache
+from metrics import record_error
+from progress import track_progress
+from workspace import job_workspace, projected_size, InsufficientSpace
+
+# Info dicts from /yt, kept so the quality callback can download without extracting again.
+# Stream URLs expire after a few hours, so entries only live for a short while.
+info_cache = TTLCache(
+    maxsize=int(os.getenv("YT_INFO_CACHE_SIZE", "128")),
+    ttl=float(os.getenv("YT_INFO_CACHE_TTL", "1800")),
+)
+
+# Bulky parts of the info dict that downloading doesn't need
+UNUSED_INFO_KEYS = ('automatic_captions', 'subtitles', 'thumbnails', 'heatmap', 'chapters', 'description')
 
 def escape_html(text: str) -> str:
     """Escapes characters for HTML parsing."""
     return text.replace("&", "&").replace("<", "<").replace(">", ">")
 
+def video_id_from_url(url: str):
+    """Returns the YouTube video id in a watch/youtu.be/shorts URL, if there is one."""
+    return parse_qs(urlsplit(canonical_url(url)).query).get('v', [None])[0]
+
+def remember_info(info: dict):
+    """Stores a trimmed copy of an extracted info dict for the quality callback."""
+    info_cache.set(info['id'], {k: v for k, v in info.items() if k not in UNUSED_INFO_KEYS})
+
+def format_buttons(info: dict, mode=None):
+    """
+    Picks the download choices offered for a video: one mp4 button per
+    supported resolution plus an audio-only button. Returns (text, callback_data) pairs.
+    """
+    video_id = info['id']
+    buttons = []
+    added_resolutions = set()
+    for f in info.get('formats', []):
+        resolution = f.get('height')
+        if resolution in [480, 720, 1080] and f.get('vcodec') != 'none' and f.get('ext') == 'mp4':
+            if resolution not in added_resolutions:
+                # Store the quality (e.g., "720") instead of a specific format_id
+                callback_data = YouTubeCallback(video_id=video_id, quality=str(resolution), ext='mp4', mode=mode).pack()
+                buttons.append((f"📹 {resolution}p (.mp4)", callback_data))
+                added_resolutions.add(resolution)
+
+    best_audio = next((f for f in info.get('formats', []) if f.get('vcodec') == 'none' and f.get('ext') == 'm4a'), None)
+    if best_audio:
+        # Store 'audio' as the quality
+        callback_data = YouTubeCallback(video_id=video_id, quality='audio', ext='mp3').pack()
+        buttons.append(("🎵 Audio Only (.mp3)", callback_data))
+    return buttons
+
 # Handler #1: For the initial /yt command
 async def handle_youtube(message: types.Message, bot: Bot):
     """
@@ -20,40 +73,20 @@ async def handle_youtube(message: types.Message, bot: Bot):
     if len(parts) < 2:
         await message.reply("Please provide a YouTube URL after the command.\nExample: `/yt <youtube_url>`")
         return
-    url = parts[1].strip()
-    
+    url, requested_mode = parse_delivery_args(parts[1])
+
     status_msg = await message.reply("Fetching video details... 🔍")
 
     try:
-        ydl_opts = {'quiet': True, 'no_warnings': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-        
-        video_id = info['id']
+        info = info_cache.get(video_id_from_url(url))
+        if info is None:
+            ydl_opts = {'quiet': True, 'no_warnings': True, 'cookiefile': 'youtube_cookies.txt'}
+            info, _ = await extract_info(url, ydl_opts, download=False)
+            remember_info(info)
+
         builder = InlineKeyboardBuilder()
-        
-        added_resolutions = set()
-        for f in info.get('formats', []):
-            resolution = f.get('height')
-            if resolution in [480, 720, 1080] and f.get('vcodec') != 'none' and f.get('ext') == 'mp4':
-                if resolution not in added_resolutions:
-                    # FIXED: Store the quality (e.g., "720") instead of a specific format_id
-                    callback_data = YouTubeCallback(video_id=video_id, quality=str(resolution), ext='mp4').pack()
-                    builder.button(
-                        text=f"📹 {resolution}p (.mp4)",
-                        callback_data=callback_data
-                    )
-                    added_resolutions.add(resolution)
-        
-        best_audio = next((f for f in info.get('formats', []) if f.get('vcodec') == 'none' and f.get('ext') == 'm4a'), None)
-        if best_audio:
-            # FIXED: Store 'audio' as the quality
-            callback_data = YouTubeCallback(video_id=video_id, quality='audio', ext='mp3').pack()
-            builder.button(
-                text=f"🎵 Audio Only (.mp3)",
-                callback_data=callback_data
-            )
-            
+        for text, callback_data in format_buttons(info, requested_mode):
+            builder.button(text=text, callback_data=callback_data)
         builder.adjust(2)
         
         if not builder.buttons:
@@ -66,6 +99,7 @@ async def handle_youtube(message: types.Message, bot: Bot):
         )
 
     except Exception as e:
+        record_error(e)
         await status_msg.edit_text(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>")
 
 
@@ -80,8 +114,14 @@ async def youtube_quality_callback(callback: types.CallbackQuery, bot: Bot):
     extension = callback_data.ext
     
     url = f"https://www.youtube.com/watch?v={video_id}"
-    
-    await callback.message.edit_text(f"Starting download... ⏳ This may take a moment.")
+    # Split parts and a compressed copy are different uploads, so the mode is part of the key
+    cache_quality = f"{quality}.{extension}|{oversize_mode(callback_data.mode)}"
+
+    if await send_from_cache(bot, callback.message.chat.id, "youtube", url, cache_quality):
+        await callback.message.delete()
+        return
+
+    status_msg = await callback.message.edit_text(f"Starting download... ⏳ This may take a moment.")
     
     base_filename = f"yt_{callback.from_user.id}_{video_id}"
     
@@ -93,7 +133,6 @@ async def youtube_quality_callback(callback: types.CallbackQuery, bot: Bot):
         download_format = f'bestvideo[height<={quality}][ext=mp4]+bestaudio[ext=m4a]/best[height<={quality}][ext=mp4]'
     
     ydl_opts = {
-        'outtmpl': f'{base_filename}.%(ext)s',
         'quiet': True,
         'no_warnings': True,
         'format': download_format,
@@ -108,60 +147,87 @@ async def youtube_quality_callback(callback: types.CallbackQuery, bot: Bot):
             'preferredquality': '192',
         }]
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-        
-        # Determine the final file path after download
-        # The actual extension might be different from what we requested (e.g., .m4a -> .mp3)
-        # So we find the file that was actually created.
-        final_path = None
-        for ext in [extension, 'm4a', 'mp4']: # Check for possible output extensions
-            potential_path = f"{base_filename}.{ext}"
-            if os.path.exists(potential_path):
-                final_path = potential_path
-                break
-        
-        if not final_path:
-            raise FileNotFoundError("Downloaded file could not be found.")
+    key = f"youtube|{video_id}|{cache_quality}"
 
-        # Rename the file to the expected final extension for consistency
-        if final_path != f"{base_filename}.{extension}":
-            os.rename(final_path, f"{base_filename}.{extension}")
+    async def download_and_send():
+        async with job_slot(callback.from_user.id, status_msg):
+            try:
+                cached_info = info_cache.get(video_id)
+                async with job_workspace(base_filename, projected_size(cached_info)) as workspace:
+                    file_path_base = workspace.path(base_filename)
+                    job_opts = {**ydl_opts, 'outtmpl': f'{file_path_base}.%(ext)s'}
+                    info = None
+                    with track_progress(callback.message, "Downloading... ⏳") as progress:
+                        if cached_info is not None:
+                            try:
+                                info, _ = await process_info(cached_info, job_opts, on_progress=progress.download)
+                            except YtdlJobError:
+                                # Most likely the stream URLs expired; fall back to a fresh extraction
+                                info_cache.pop(video_id)
+                        if info is None:
+                            info, _ = await extract_info(url, job_opts, on_progress=progress.download)
+
+                    # Determine the final file path after download
+                    # The actual extension might be different from what we requested (e.g., .m4a -> .mp3)
+                    # So we find the file that was actually created.
+                    final_path = None
+                    for ext in [extension, 'm4a', 'mp4']: # Check for possible output extensions
+                        potential_path = f"{file_path_base}.{ext}"
+                        if os.path.exists(potential_path):
+                            final_path = potential_path
+                            break
         
-        file_path = f"{base_filename}.{extension}"
+                    if not final_path:
+                        raise FileNotFoundError("Downloaded file could not be found.")
+
+                    # Rename the file to the expected final extension for consistency
+                    file_path = f"{file_path_base}.{extension}"
+                    if final_path != file_path:
+                        os.rename(final_path, file_path)
         
-        if extension == 'mp3':
-            title = info.get('title', 'Unknown Title')
-            artist = info.get('artist') or info.get('uploader', 'Unknown Artist')
-            audio_to_send = FSInputFile(file_path, filename=f"{artist} - {title}.mp3")
-            await bot.send_audio(callback.message.chat.id, audio=audio_to_send, caption=f"🎵 <b>{escape_html(title)}</b>")
+                    if extension == 'mp3':
+                        title = info.get('title', 'Unknown Title')
+                        artist = info.get('artist') or info.get('uploader', 'Unknown Artist')
+                        audio_to_send = FSInputFile(file_path, filename=f"{artist} - {title}.mp3")
+                        caption = f"🎵 <b>{escape_html(title)}</b>"
+                        sent = await bot.send_audio(callback.message.chat.id, audio=audio_to_send, caption=caption)
+                        entry = remember_sent("youtube", url, sent, caption, cache_quality)
         
-        else: # Handle Video
-            caption = f"✅ <b>{escape_html(info.get('title', 'N/A'))}</b>"
-            file_size = os.path.getsize(file_path)
-
-            if file_size > MAX_SIZE:
-                await callback.message.edit_text("File is large, compressing... 🎥")
-                compressed_path = f"{base_filename}_compressed.mp4"
-                duration_seconds = info.get('duration', 0)
-                compress_video_to_target_size(file_path, compressed_path, duration_seconds)
-
-                if os.path.getsize(compressed_path) > MAX_SIZE:
-                    await callback.message.edit_text("❌ Sorry, this video is too long to be compressed under 50MB.")
-                    cleanup_files(file_path, compressed_path)
-                    return
+                    else: # Handle Video
+                        caption = f"✅ <b>{escape_html(info.get('title', 'N/A'))}</b>"
+                        file_size = os.path.getsize(file_path)
+
+                        if file_size > MAX_SIZE and oversize_mode(callback_data.mode) == "split":
+                            await callback.message.edit_text("File is large, splitting into parts... ✂️")
+                            part_paths = await split_video_stream_copy(file_path, f"{file_path_base}_part", info.get('duration', 0))
+                            sent = await send_video_parts(bot, callback.message.chat.id, part_paths, caption)
+                            entry = remember_sent("youtube", url, sent, caption, cache_quality)
+                        elif file_size > MAX_SIZE:
+                            await callback.message.edit_text("File is large, compressing... 🎥")
+                            compressed_path = f"{file_path_base}_compressed.mp4"
+                            duration_seconds = info.get('duration', 0)
+                            with track_progress(callback.message, "File is large, compressing... 🎥") as progress:
+                                await compress_video(file_path, compressed_path, duration_seconds, on_progress=progress.encode)
+
+                            if os.path.getsize(compressed_path) > MAX_SIZE:
+                                await callback.message.edit_text("❌ Sorry, this video is too long to be compressed under 50MB.")
+                                return
                 
-                video_to_send = FSInputFile(compressed_path)
-                await bot.send_video(callback.message.chat.id, video=video_to_send, caption=caption)
-                cleanup_files(file_path, compressed_path)
-            else:
-                video_to_send = FSInputFile(file_path)
-                await bot.send_video(callback.message.chat.id, video=video_to_send, caption=caption)
-                cleanup_files(file_path)
+                            video_to_send = FSInputFile(compressed_path)
+                            sent = await bot.send_video(callback.message.chat.id, video=video_to_send, caption=caption)
+                            entry = remember_sent("youtube", url, sent, caption, cache_quality)
+                        else:
+                            video_to_send = FSInputFile(file_path)
+                            sent = await bot.send_video(callback.message.chat.id, video=video_to_send, caption=caption)
+                            entry = remember_sent("youtube", url, sent, caption, cache_quality)
 
-        await callback.message.delete()
+                await callback.message.delete()
+                return entry
 
-    except Exception as e:
-        await callback.message.edit_text(f"❌ An error occurred during download:\n<code>{escape_html(str(e))}</code>")
-        cleanup_files(f"{base_filename}.mp4", f"{base_filename}.mp3", f"{base_filename}.m4a", f"{base_filename}_compressed.mp4")
\ No newline at end of file
+            except InsufficientSpace as e:
+                await callback.message.edit_text(f"❌ {e}")
+            except Exception as e:
+                record_error(e)
+                await callback.message.edit_text(f"❌ An error occurred during download:\n<code>{escape_html(str(e))}</code>")
+
+    await deliver_once(key, download_and_send, bot, callback.message.chat.id, status_msg)
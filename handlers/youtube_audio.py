@@ -1,8 +1,13 @@
 import os
 from aiogram import types, Bot
 from aiogram.types import FSInputFile
-from yt_dlp import YoutubeDL
-from utils import cleanup_files
+from ytdl_pool import extract_info
+from file_cache import send_from_cache, remember_sent, canonical_url
+from scheduler import job_slot
+from singleflight import deliver_once
+from metrics import record_error
+from progress import track_progress
+from workspace import job_workspace, AUDIO_JOB_BYTES, InsufficientSpace
 
 def escape_html(text: str) -> str:
     """Escapes characters for HTML parsing."""
@@ -15,11 +20,13 @@ async def handle_youtube_audio(message: types.Message, bot: Bot):
         return
     url = parts[1].strip()
 
+    if await send_from_cache(bot, message.chat.id, "youtube_audio", url):
+        return
+
     status_msg = await message.reply("Downloading and converting to MP3... 🎶")
     base_filename = f"yta_{message.from_user.id}_{message.message_id}"
 
     ydl_opts = {
-        'outtmpl': f'{base_filename}.%(ext)s',
         'quiet': True,
         'no_warnings': True,
         'format': 'bestaudio/best',
@@ -31,26 +38,40 @@ async def handle_youtube_audio(message: types.Message, bot: Bot):
         }],
     }
 
-    try:
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            file_path = f"{base_filename}.mp3"
-        
-        title = info.get('title', 'Unknown Title')
-        artist = info.get('artist') or info.get('uploader', 'Unknown Artist')
-        if len(title) > 200: title = title[:200] + '...'
-        if len(artist) > 50: artist = artist[:50] + '...'
-
-        audio_to_send = FSInputFile(file_path, filename=f"{artist} - {title}.mp3")
-        await bot.send_audio(
-            message.chat.id,
-            audio=audio_to_send,
-            caption=f"🎵 <b>{escape_html(title)}</b>",
-            parse_mode="HTML"
-        )
-        await status_msg.delete()
-        cleanup_files(file_path)
-    except Exception as e:
-        await status_msg.delete()
-        await message.reply(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>", parse_mode="HTML")
-        cleanup_files(f"{base_filename}.mp3")
\ No newline at end of file
+    key = f"youtube_audio|{canonical_url(url)}"
+
+    async def download_and_send():
+        async with job_slot(message.from_user.id, status_msg):
+            try:
+                async with job_workspace(base_filename, AUDIO_JOB_BYTES) as workspace:
+                    file_path_base = workspace.path(base_filename)
+                    with track_progress(status_msg, "Downloading and converting to MP3... 🎶") as progress:
+                        info, _ = await extract_info(url, {**ydl_opts, 'outtmpl': f'{file_path_base}.%(ext)s'},
+                                                     on_progress=progress.download)
+                    file_path = f"{file_path_base}.mp3"
+
+                    title = info.get('title', 'Unknown Title')
+                    artist = info.get('artist') or info.get('uploader', 'Unknown Artist')
+                    if len(title) > 200: title = title[:200] + '...'
+                    if len(artist) > 50: artist = artist[:50] + '...'
+
+                    audio_to_send = FSInputFile(file_path, filename=f"{artist} - {title}.mp3")
+                    caption = f"🎵 <b>{escape_html(title)}</b>"
+                    sent = await bot.send_audio(
+                        message.chat.id,
+                        audio=audio_to_send,
+                        caption=caption,
+                        parse_mode="HTML"
+                    )
+                entry = remember_sent("youtube_audio", url, sent, caption)
+                await status_msg.delete()
+                return entry
+            except InsufficientSpace as e:
+                await status_msg.delete()
+                await message.reply(f"❌ {e}")
+            except Exception as e:
+                record_error(e)
+                await status_msg.delete()
+                await message.reply(f"❌ An error occurred:\n<code>{escape_html(str(e))}</code>", parse_mode="HTML")
+
+    await deliver_once(key, download_and_send, bot, message.chat.id, status_msg)
@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import logging
+
+import aiohttp
+
+# Re-poll bounds, in seconds. The delay in between follows the Horde's own wait_time estimate.
+MIN_POLL_INTERVAL = 2.0
+MAX_POLL_INTERVAL = 20.0
+
+
+class HordeError(Exception):
+    """Raised when the Horde rejects, faults or times out a generation job."""
+
+
+def api_base() -> str:
+    return os.getenv("HORDE_API_BASE", "https://stablehorde.net/api/v2").rstrip("/")
+
+
+class _Job:
+    def __init__(self, job_id, on_update):
+        self.job_id = job_id
+        self.on_update = on_update
+        self.next_poll = time.monotonic() + MIN_POLL_INTERVAL
+        self.future = asyncio.get_running_loop().create_future()
+        self.last_state = None
+        self.pending_check = None  # newest status not yet passed to on_update
+        self.update_task = None
+
+
+class HordePoller:
+    """
+    Tracks every outstanding Horde job from a single background task. Each job
+    is re-polled when the Horde expects it to be ready (half its reported
+    wait_time, within MIN/MAX_POLL_INTERVAL), so no handler sits in its own
+    sleep loop. Status updates run in their own task per job, so a slow
+    Telegram edit never holds up the polling of other jobs.
+    """
+
+    def __init__(self, http_session: aiohttp.ClientSession):
+        self.http_session = http_session
+        self._jobs = {}  # job id -> _Job
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._jobs)
+
+    async def submit(self, payload: dict, api_key: str, client_agent: str) -> str:
+        """Submits a generation request and returns its job id."""
+        headers = {"apikey": api_key, "Client-Agent": client_agent}
+        async with self.http_session.post(f"{api_base()}/generate/async", headers=headers, json=payload) as response:
+            if not response.ok:
+                raise HordeError(f"Failed to submit request: {await response.text()}")
+            job_data = await response.json()
+        job_id = job_data.get("id")
+        if not job_id:
+            raise HordeError("Could not get a Job ID from the Horde.")
+        return job_id
+
+    async def wait(self, job_id: str, timeout: float = None, on_update=None) -> dict:
+        """
+        Waits for a job and returns its final status (with 'generations').
+        `on_update(check)` is called in the background whenever the queue
+        position or wait time changes; if it is still busy, only the newest
+        status is passed on next. Raises HordeError if the job faults or isn't
+        done within `timeout` seconds (HORDE_TIMEOUT, default 600).
+        """
+        if timeout is None:
+            timeout = float(os.getenv("HORDE_TIMEOUT", "600"))
+        job = _Job(job_id, on_update)
+        self._jobs[job_id] = job
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        try:
+            return await asyncio.wait_for(job.future, timeout)
+        except asyncio.TimeoutError:
+            await self._cancel(job_id)
+            raise HordeError("The horde did not finish the image in time. Please try again later.") from None
+        finally:
+            self._jobs.pop(job_id, None)
+            if job.update_task is not None:
+                # The caller shows the outcome now; a late queue update must not overwrite it
+                job.update_task.cancel()
+
+    async def _run(self):
+        while self._jobs:
+            now = time.monotonic()
+            due = [job for job in self._jobs.values() if job.next_poll <= now and not job.future.done()]
+            if due:
+                await asyncio.gather(*(self._poll(job) for job in due))
+                continue
+            next_poll = min((job.next_poll for job in self._jobs.values()), default=now)
+            self._wakeup.clear()
+            try:
+                # Sleep until the next job is due, or until a new job is added
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, next_poll - now))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job: _Job):
+        try:
+            async with self.http_session.get(f"{api_base()}/generate/check/{job.job_id}") as response:
+                if response.status == 404:
+                    raise HordeError("The horde lost this job. Please try again.")
+                check = await response.json()
+
+            if check.get("faulted"):
+                raise HordeError("Job faulted.")
+            if not check.get("is_possible", True):
+                await self._cancel(job.job_id)
+                raise HordeError("No horde worker can generate this request right now.")
+            if check.get("done"):
+                async with self.http_session.get(f"{api_base()}/generate/status/{job.job_id}") as response:
+                    job.future.set_result(await response.json())
+                return
+
+            wait_time = check.get("wait_time") or 0
+            job.next_poll = time.monotonic() + min(max(wait_time / 2, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+            state = (check.get("queue_position"), wait_time, check.get("processing"))
+            if job.on_update and state != job.last_state:
+                job.last_state = state
+                job.pending_check = check
+                if job.update_task is None or job.update_task.done():
+                    job.update_task = asyncio.create_task(self._send_updates(job))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning("Polling horde job %s failed, retrying: %s", job.job_id, e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            if not job.future.done() and job.next_poll <= time.monotonic():
+                # A transient error left the job without a schedule; try again shortly
+                job.next_poll = time.monotonic() + MIN_POLL_INTERVAL
+
+    async def _send_updates(self, job: _Job):
+        """Passes the newest status to on_update until there is nothing new."""
+        while job.pending_check is not None and not job.future.done():
+            check, job.pending_check = job.pending_check, None
+            try:
+                await job.on_update(check)
+            except Exception as e:
+                logging.debug("Horde status update for %s failed: %s", job.job_id, e)
+
+    async def _cancel(self, job_id: str):
+        """Tells the Horde to drop a job we no longer wait for, so it doesn't cost kudos."""
+        try:
+            async with self.http_session.delete(f"{api_base()}/generate/status/{job_id}"):
+                pass
+        except aiohttp.ClientError as e:
+            logging.debug("Could not cancel horde job %s: %s", job_id, e)
+
+
+_poller = None
+
+def get_horde_poller(http_session: aiohttp.ClientSession) -> HordePoller:
+    """Returns the shared poller, bound to the bot's HTTP session on first use."""
+    global _poller
+    if _poller is None:
+        _poller = HordePoller(http_session)
+    return _poller
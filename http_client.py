@@ -0,0 +1,24 @@
+import os
+import aiohttp
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """
+    Creates the one aiohttp session the bot uses for all outbound HTTP.
+    Connections are kept alive and reused, DNS answers are cached, and the
+    number of connections per upstream host is capped. Must be called from
+    inside the running event loop and closed on shutdown.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        limit_per_host=int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10")),
+        ttl_dns_cache=300,
+        keepalive_timeout=30,
+        enable_cleanup_closed=True,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=float(os.getenv("HTTP_TIMEOUT", "60")),
+        connect=10,
+        sock_read=30,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
@@ -1,12 +1,16 @@
+from typing import Optional
 from aiogram.filters.callback_data import CallbackData
 
 class YouTubeCallback(CallbackData, prefix="yt"):
     """
     CallbackData for YouTube quality selection.
+    Fields:
+    - mode: How to deliver a video over 50MB ('compress' or 'split'), None for the default.
     """
     video_id: str
     quality: str
     ext: str
+    mode: Optional[str] = None
 
 # Replace the old TempMailCallback with this new one
 class TempMailCallback(CallbackData, prefix="mail"):
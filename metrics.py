@@ -0,0 +1,275 @@
+"""
+A small metrics registry rendered in the Prometheus text format and served
+over a local HTTP endpoint.
+
+Handlers don't pass command names around: the dispatcher middleware stores
+the command being handled in a context variable, and the download pool,
+compression service and upload middleware read it from there.
+"""
+import os
+import time
+import logging
+import resource
+import contextvars
+from contextlib import contextmanager
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery, FSInputFile, BufferedInputFile
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Commands we report on; anything else is grouped under "other" to keep label sets small
+COMMANDS = {
+    "start", "yt", "tik", "fb", "ig", "x", "pn", "tdl", "sp", "song",
+    "qr", "paste", "imagine", "get_email",
+}
+# Callback data prefixes and the command whose flow they belong to
+CALLBACK_COMMANDS = {"yt": "yt", "mail": "get_email"}
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+current_command = contextvars.ContextVar("current_command", default="other")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    body = ",".join(
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in labels
+    )
+    return "{" + body + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A gauge whose value is read from `callback` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            lines.append(f"{self.name} {self.callback()}")
+        except Exception as e:
+            logging.debug("Could not read %s %s: %s", self.kind, self.name, e)
+        return lines
+
+
+class CounterValue(Gauge):
+    """A counter whose running total is kept elsewhere and read from `callback` at scrape time."""
+
+    kind = "counter"
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in self._series.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+COMMAND_SECONDS = register(Histogram("bot_command_seconds", "Time spent handling a command, end to end."))
+STAGE_SECONDS = register(Histogram("bot_stage_seconds", "Time spent in one stage (extract, download, compress, upload) of a command."))
+DOWNLOADED_BYTES = register(Counter("bot_downloaded_bytes_total", "Bytes of media downloaded."))
+UPLOADED_BYTES = register(Counter("bot_uploaded_bytes_total", "Bytes of media uploaded to Telegram."))
+FFMPEG_SECONDS = register(Counter("bot_ffmpeg_encode_seconds_total", "Seconds spent running FFmpeg encodes."))
+ERRORS = register(Counter("bot_errors_total", "Errors while handling commands, by exception type."))
+
+def _current_rss():
+    """Current resident memory in bytes, from /proc (so the gauge is left out where that doesn't exist)."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+register(Gauge("process_resident_memory_bytes", "Resident memory of the bot process.", _current_rss))
+register(Gauge("process_max_resident_memory_bytes", "Peak resident memory of the bot process.",
+               lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024))
+register(CounterValue("process_cpu_seconds_total", "CPU time used by the bot process.",
+               lambda: sum(resource.getrusage(resource.RUSAGE_SELF)[:2])))
+
+
+def command_label(event):
+    """Returns the metrics label for the command an update belongs to."""
+    if isinstance(event, Message) and event.text and event.text.startswith("/"):
+        command = event.text.split(maxsplit=1)[0][1:].split("@")[0].lower()
+        return command if command in COMMANDS else "other"
+    if isinstance(event, CallbackQuery) and event.data:
+        return CALLBACK_COMMANDS.get(event.data.split(":", 1)[0], "other")
+    return "other"
+
+
+@contextmanager
+def stage(name, command=None):
+    """Times a stage of the current command into bot_stage_seconds."""
+    command = command or current_command.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, command=command, stage=name)
+
+
+def record_error(error, command=None):
+    """Counts an exception that a handler caught and reported to the user."""
+    ERRORS.inc(command=command or current_command.get(), type=type(error).__name__)
+
+
+def count_downloaded(path, command=None):
+    try:
+        DOWNLOADED_BYTES.inc(os.path.getsize(path), command=command or current_command.get())
+    except (OSError, TypeError):
+        pass
+
+
+class CommandMetricsMiddleware(BaseMiddleware):
+    """Times every handled update and remembers its command for the code it calls."""
+
+    async def __call__(self, handler, event, data):
+        command = command_label(event)
+        token = current_command.set(command)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            record_error(e, command)
+            raise
+        finally:
+            COMMAND_SECONDS.observe(time.perf_counter() - started, command=command)
+            current_command.reset(token)
+
+
+# Bot API methods that upload media, and the fields that may carry a file
+UPLOAD_METHODS = {"sendVideo", "sendAudio", "sendPhoto", "sendDocument", "sendAnimation", "sendMediaGroup"}
+UPLOAD_FIELDS = ("video", "audio", "photo", "document", "animation", "media")
+
+
+def _input_file_size(value):
+    if isinstance(value, FSInputFile):
+        try:
+            return os.path.getsize(value.path)
+        except OSError:
+            return 0
+    if isinstance(value, BufferedInputFile):
+        return len(value.data)
+    if isinstance(value, list):
+        return sum(_input_file_size(getattr(item, "media", None)) for item in value)
+    return 0
+
+
+class UploadMetricsMiddleware(BaseRequestMiddleware):
+    """Times media uploads to Telegram and counts the uploaded bytes."""
+
+    async def __call__(self, make_request, bot, method):
+        if method.__api_method__ not in UPLOAD_METHODS:
+            return await make_request(bot, method)
+        size = sum(_input_file_size(getattr(method, field, None)) for field in UPLOAD_FIELDS)
+        with stage("upload"):
+            response = await make_request(bot, method)
+        if size:
+            UPLOADED_BYTES.inc(size, command=current_command.get())
+        return response
+
+
+def setup_metrics(dp, bot):
+    """Installs the command and upload middlewares and the queue and session gauges."""
+    from utils import get_compression_service
+    from scheduler import get_scheduler
+    from data_storage import get_temp_mail_storage
+    from flood_control import get_flood_control
+    from workspace import get_workspace_manager
+
+    register(Gauge("bot_jobs_running", "Download jobs holding a scheduler slot.", lambda: get_scheduler().running))
+    register(Gauge("bot_jobs_waiting", "Download jobs queued for a scheduler slot.", lambda: get_scheduler().waiting))
+    register(Gauge("bot_compressions_running", "FFmpeg encodes in progress.", lambda: get_compression_service().running))
+    register(Gauge("bot_compressions_waiting", "Videos queued for compression.", lambda: get_compression_service().waiting))
+    register(Gauge("bot_temp_mail_sessions", "Active temporary email sessions.", lambda: len(get_temp_mail_storage())))
+    register(Gauge("bot_outbound_waiting", "Bot API calls waiting for a flood control turn.", lambda: get_flood_control().waiting))
+    register(CounterValue("bot_outbound_coalesced_total", "Message edits merged into a newer edit.", lambda: get_flood_control().coalesced))
+    register(CounterValue("bot_flood_waits_total", "TelegramRetryAfter responses received.", lambda: get_flood_control().flood_waits))
+    register(Gauge("bot_workspaces_active", "Job scratch directories in use.", lambda: get_workspace_manager().active))
+    register(CounterValue("bot_workspaces_rejected_total", "Jobs turned away for lack of disk space.", lambda: get_workspace_manager().rejected))
+
+    dp.message.middleware(CommandMetricsMiddleware())
+    dp.callback_query.middleware(CommandMetricsMiddleware())
+    bot.session.middleware(UploadMetricsMiddleware())
+
+
+async def start_metrics_server():
+    """
+    Serves /metrics on METRICS_HOST:METRICS_PORT (default 127.0.0.1:9108).
+    Returns the runner to clean up on shutdown, or None if METRICS_PORT is 0.
+    """
+    port = int(os.getenv("METRICS_PORT", "9108"))
+    if not port:
+        return None
+    host = os.getenv("METRICS_HOST", "127.0.0.1")
+
+    async def metrics_view(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import contextmanager
+
+from aiogram.exceptions import TelegramBadRequest
+
+from utils import format_duration
+
+def format_bytes(size) -> str:
+    """Formats a byte count as e.g. '12.3 MB'."""
+    size = float(size or 0)
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def progress_bar(fraction: float, width: int = 12) -> str:
+    filled = round(max(0.0, min(1.0, fraction)) * width)
+    return "▓" * filled + "░" * (width - filled)
+
+class JobProgress:
+    """
+    The live progress of one job, shown under `title` in its status message.
+    download() and encode() are the callbacks for ytdl_pool and compress_video;
+    they only record the newest state, the reporter decides when to show it.
+    """
+
+    def __init__(self, reporter, status_msg, title):
+        self.reporter = reporter
+        self.status_msg = status_msg
+        self.chat_id = status_msg.chat.id
+        self.title = title
+        self.text = None        # newest text
+        self.shown_text = None  # text currently in the message
+        self.closed = False
+
+    def set_title(self, title):
+        self.title = title
+
+    def download(self, update: dict):
+        """Takes a progress update from a yt-dlp worker."""
+        status = update.get("status")
+        if status == "postprocess":
+            self._set("⚙️ Converting...")
+        elif status == "finished":
+            self._set("✅ Downloaded, processing...")
+        elif status == "downloading":
+            downloaded, total = update.get("downloaded") or 0, update.get("total")
+            if total:
+                fraction = downloaded / total
+                lines = [f"{progress_bar(fraction)} {fraction * 100:.1f}%",
+                         f"📦 {format_bytes(downloaded)} of {format_bytes(total)}"]
+            else:
+                lines = [f"📦 {format_bytes(downloaded)} downloaded"]
+            stats = []
+            if update.get("speed"):
+                stats.append(f"⚡ {format_bytes(update['speed'])}/s")
+            if update.get("eta") is not None:
+                stats.append(f"⏱ ETA {format_duration(update['eta'])}")
+            if stats:
+                lines.append(" · ".join(stats))
+            self._set("\n".join(lines))
+
+    def encode(self, fraction, speed=None):
+        """Takes a progress update from FFmpeg. `fraction` is None when the duration is unknown."""
+        lines = [f"{progress_bar(fraction)} {fraction * 100:.1f}%"] if fraction is not None else []
+        if speed:
+            lines.append(f"⚡ {speed}")
+        if lines:
+            self._set("\n".join(lines))
+
+    def _set(self, details):
+        if self.closed:
+            return
+        self.text = f"{self.title}\n\n{details}"
+        self.reporter.schedule(self)
+
+class _ChatState:
+    def __init__(self):
+        self.pending = {}      # jobs with an unshown update, oldest first
+        self.next_edit = 0.0   # monotonic time of the next allowed edit
+        self.task = None
+
+class ProgressReporter:
+    """
+    Turns progress updates into status message edits. Updates are coalesced,
+    so only the newest state of a job is ever sent, and a chat gets at most
+    one edit per PROGRESS_INTERVAL seconds no matter how many of its jobs are
+    running. This keeps well inside Telegram's edit limits.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or float(os.getenv("PROGRESS_INTERVAL", "3"))
+        self._chats = {}  # chat id -> _ChatState
+
+    @contextmanager
+    def track(self, status_msg, title):
+        """Reports progress in status_msg while the block runs. Nothing is edited after it ends."""
+        job = JobProgress(self, status_msg, title)
+        try:
+            yield job
+        finally:
+            job.closed = True
+            chat = self._chats.get(job.chat_id)
+            if chat is not None:
+                chat.pending.pop(job, None)
+
+    def schedule(self, job: JobProgress):
+        chat = self._chats.setdefault(job.chat_id, _ChatState())
+        chat.pending.setdefault(job, None)
+        if chat.task is None:
+            chat.task = asyncio.create_task(self._flush(job.chat_id, chat))
+
+    async def _flush(self, chat_id, chat):
+        try:
+            while True:
+                delay = chat.next_edit - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if not chat.pending:
+                    break
+                job = next(iter(chat.pending))
+                del chat.pending[job]
+                text = job.text
+                if job.closed or text == job.shown_text:
+                    continue
+                job.shown_text = text
+                chat.next_edit = time.monotonic() + self.interval
+                try:
+                    await job.status_msg.edit_text(text)
+                except TelegramBadRequest as e:
+                    # The message was deleted or already shows this text
+                    logging.debug("Progress edit skipped: %s", e)
+                except Exception as e:
+                    logging.warning("Could not show progress in chat %s: %s", chat_id, e)
+        finally:
+            chat.task = None
+            if not chat.pending:
+                self._chats.pop(chat_id, None)
+
+_reporter = None
+
+def get_progress_reporter() -> ProgressReporter:
+    """Returns the shared progress reporter, created on first use."""
+    global _reporter
+    if _reporter is None:
+        _reporter = ProgressReporter()
+    return _reporter
+
+def track_progress(status_msg, title):
+    """Shortcut for get_progress_reporter().track(status_msg, title)."""
+    return get_progress_reporter().track(status_msg, title)
@@ -0,0 +1,167 @@
+import os
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class _Ticket:
+    """One job waiting for (or holding) a slot in the scheduler."""
+
+    def __init__(self, user_id, on_position):
+        self.user_id = user_id
+        self.on_position = on_position
+        self.future = asyncio.get_running_loop().create_future()
+        self.position = None
+
+
+class JobScheduler:
+    """
+    Hands out job slots fairly across users. Waiting jobs are served
+    round-robin by user, so someone who queued twenty links only gets one
+    turn per round. At most `max_concurrent` jobs run at once and at most
+    `per_user` of them may belong to the same user.
+    """
+
+    def __init__(self, max_concurrent: int, per_user: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_user = max(1, per_user)
+        self._queues = {}        # user_id -> deque of waiting tickets
+        self._turns = deque()    # users with waiting jobs, in round-robin order
+        self._running = {}       # user_id -> number of running jobs
+        self.running = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, user_id, on_position=None):
+        """
+        Waits for a slot for this user's job. While queued, `on_position` is
+        awaited with the job's 1-based queue position every time it changes.
+        """
+        ticket = _Ticket(user_id, on_position)
+        if user_id not in self._queues:
+            self._queues[user_id] = deque()
+            self._turns.append(user_id)
+        self._queues[user_id].append(ticket)
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # The slot was granted just as we were cancelled, so give it back
+                self._release(user_id)
+            else:
+                self._remove(ticket)
+                self._dispatch()
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    def _dispatch(self):
+        """Starts as many waiting jobs as the limits allow, then refreshes positions."""
+        while self.running < self.max_concurrent:
+            for _ in range(len(self._turns)):
+                user_id = self._turns[0]
+                self._turns.rotate(-1)
+                if self._running.get(user_id, 0) < self.per_user:
+                    self._start(self._queues[user_id].popleft())
+                    if not self._queues[user_id]:
+                        del self._queues[user_id]
+                        self._turns.remove(user_id)
+                    break
+            else:
+                break
+        self._publish_positions()
+
+    def _start(self, ticket):
+        self._running[ticket.user_id] = self._running.get(ticket.user_id, 0) + 1
+        self.running += 1
+        ticket.future.set_result(None)
+
+    def _release(self, user_id):
+        self.running -= 1
+        self._running[user_id] -= 1
+        if not self._running[user_id]:
+            del self._running[user_id]
+        self._dispatch()
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.user_id]
+                self._turns.remove(ticket.user_id)
+
+    def _publish_positions(self):
+        """
+        Works out the order in which waiting jobs will be served (one job per
+        user per round) and tells every job whose position changed.
+        """
+        queues = [list(self._queues[user_id]) for user_id in self._turns]
+        position = 0
+        for round_index in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if round_index < len(queue):
+                    position += 1
+                    ticket = queue[round_index]
+                    if ticket.position != position:
+                        ticket.position = position
+                        if ticket.on_position:
+                            asyncio.create_task(self._notify(ticket, position))
+
+    @staticmethod
+    async def _notify(ticket, position):
+        try:
+            await ticket.on_position(position)
+        except Exception as e:
+            logging.debug("Could not publish queue position: %s", e)
+
+
+_scheduler = None
+
+
+def get_scheduler() -> JobScheduler:
+    """Returns the shared scheduler, sized from the environment on first use."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler(
+            max_concurrent=int(os.getenv("MAX_CONCURRENT_JOBS", os.getenv("YTDL_WORKERS", "4"))),
+            per_user=int(os.getenv("MAX_JOBS_PER_USER", "2")),
+        )
+    return _scheduler
+
+
+@asynccontextmanager
+async def job_slot(user_id, status_msg):
+    """
+    Runs a download job through the shared scheduler. While the job waits,
+    `status_msg` shows its place in the queue; once it starts the original
+    text is restored.
+    """
+    original_text = status_msg.html_text if status_msg.text else None
+    shown = False
+    started = False
+
+    async def show_position(position):
+        nonlocal shown
+        if original_text is None or started:
+            return
+        shown = True
+        await status_msg.edit_text(f"{original_text}\n\n⏳ Position {position} in queue...")
+
+    async with get_scheduler().slot(user_id, show_position):
+        started = True
+        if shown:
+            try:
+                await status_msg.edit_text(original_text)
+            except Exception:
+                pass
+        yield
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+
+from file_cache import send_cached_media
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    work, and everyone who arrives while it is still running waits for the
+    same result instead of starting their own.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> future of the running call
+
+    def __contains__(self, key):
+        return key in self._calls
+
+    async def do(self, key, work):
+        """
+        Returns (result, shared). `shared` is True when the result came from
+        another caller's run. If that run was cancelled, the next waiter takes over.
+        """
+        while True:
+            future = self._calls.get(key)
+            if future is None:
+                break
+            try:
+                return await asyncio.shield(future), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # we were cancelled ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting, so don't let an unretrieved exception be logged
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._calls[key]
+
+
+downloads = SingleFlight()
+
+
+async def deliver_once(key, work, bot, chat_id, status_msg, caption_suffix=""):
+    """
+    Runs a download job at most once per key at a time. `work` downloads the
+    media, sends it to its own chat and returns the file_cache entry (or None
+    on failure). Requests that joined a running job get the same files re-sent
+    to their chat by file_id.
+    """
+    entry, shared = await downloads.do(key, work)
+    if not shared:
+        return
+    if entry is None:
+        await status_msg.edit_text("❌ Could not download this link. Please try again later.")
+        return
+
+    logging.info("Delivered coalesced download %s to chat %s", key, chat_id)
+    caption = entry["caption"]
+    if caption_suffix:
+        caption = (caption or "") + caption_suffix
+    await send_cached_media(bot, chat_id, entry, caption=caption)
+    await status_msg.delete()
@@ -0,0 +1,187 @@
+import os
+import re
+import html
+import time
+import base64
+import asyncio
+import logging
+
+import aiohttp
+
+from data_storage import create_storage
+
+# open.spotify.com/track/<id>, open.spotify.com/intl-de/track/<id> and spotify:track:<id>
+TRACK_URL_RE = re.compile(r"(?:open\.spotify\.com/(?:intl-[\w-]+/)?track/|spotify:track:)([A-Za-z0-9]{22})")
+# The same for albums and playlists; group 1 is the kind, group 2 the id
+COLLECTION_URL_RE = re.compile(r"(?:open\.spotify\.com/(?:intl-[\w-]+/)?|spotify:)(album|playlist)[/:]([A-Za-z0-9]{22})")
+
+TITLE_RE = re.compile(rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+META_RE = re.compile(rb"<meta\s[^>]*>", re.IGNORECASE)
+META_ATTR_RE = re.compile(rb'(property|name|content)="([^"]*)"', re.IGNORECASE)
+
+# Stop reading a page after this much even if the metadata never showed up
+MAX_PAGE_BYTES = 512 * 1024
+
+
+def track_id_from_url(url: str):
+    """Returns the Spotify track id in a track URL or URI, or None."""
+    match = TRACK_URL_RE.search(url)
+    return match.group(1) if match else None
+
+
+def collection_from_url(url: str):
+    """Returns ('album' or 'playlist', id) for an album or playlist URL or URI, or None."""
+    match = COLLECTION_URL_RE.search(url)
+    return (match.group(1), match.group(2)) if match else None
+
+
+def track_url(track_id: str) -> str:
+    return f"https://open.spotify.com/track/{track_id}"
+
+
+def _parse_head(head: bytes) -> dict:
+    """Pulls the <title> and the og:* meta tags out of the start of a page."""
+    metadata = {}
+    title = TITLE_RE.search(head)
+    if title:
+        metadata["title"] = html.unescape(title.group(1).decode("utf-8", "replace")).strip()
+    for tag in META_RE.findall(head):
+        attrs = {k.lower(): v for k, v in META_ATTR_RE.findall(tag)}
+        prop = attrs.get(b"property") or attrs.get(b"name")
+        if prop and prop.startswith(b"og:") and b"content" in attrs:
+            metadata[prop.decode()] = html.unescape(attrs[b"content"].decode("utf-8", "replace"))
+    return metadata
+
+
+async def fetch_page_metadata(http_session: aiohttp.ClientSession, url: str) -> dict:
+    """
+    Reads a Spotify page only as far as its metadata: the download stops once
+    the <title> and og:title are in, or at </head>, instead of fetching and
+    parsing the whole document. Returns {'title': ..., 'og:title': ..., ...}.
+    """
+    head = b""
+    async with http_session.get(url, headers={'User-Agent': 'Mozilla/5.0'}) as response:
+        if response.status != 200:
+            raise ValueError(f"Spotify returned a non-200 status code: {response.status}")
+        async for chunk in response.content.iter_chunked(16 * 1024):
+            head += chunk
+            lowered = head.lower()
+            end = lowered.find(b"</head>")
+            if end != -1:
+                head = head[:end]
+                break
+            if b"</title>" in lowered and b'property="og:title"' in lowered:
+                # Let the tag that holds og:title finish before parsing
+                if lowered.rfind(b">") > lowered.rfind(b'property="og:title"'):
+                    break
+            if len(head) >= MAX_PAGE_BYTES:
+                break
+    return _parse_head(head)
+
+
+# Track id -> {'title', 'video_id', 'yt_title', 'artist', 'duration'} for tracks we resolved before
+_track_cache = None
+
+def get_track_cache():
+    """Returns the persistent Spotify track resolution cache (SPOTIFY_CACHE_TTL, default 30 days)."""
+    global _track_cache
+    if _track_cache is None:
+        _track_cache = create_storage(
+            "spotify_tracks",
+            ttl=float(os.getenv("SPOTIFY_CACHE_TTL", str(30 * 24 * 3600))),
+            maxsize=int(os.getenv("SPOTIFY_CACHE_MAX_TRACKS", "50000")),
+        )
+    return _track_cache
+
+
+class SpotifyAPI:
+    """
+    A minimal Spotify Web API client using the client credentials flow, which
+    is enough to list the tracks of public albums and playlists. The access
+    token is cached until shortly before it expires.
+    """
+
+    API_BASE = "https://api.spotify.com/v1"
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+    def __init__(self, client_id: str, client_secret: str):
+        self._credentials = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = asyncio.Lock()
+
+    async def _access_token(self, http_session: aiohttp.ClientSession) -> str:
+        async with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires_at:
+                async with http_session.post(
+                    self.TOKEN_URL,
+                    data={"grant_type": "client_credentials"},
+                    headers={"Authorization": f"Basic {self._credentials}"},
+                ) as response:
+                    if response.status != 200:
+                        raise ValueError(f"Spotify rejected the API credentials (status {response.status}).")
+                    payload = await response.json()
+                self._token = payload["access_token"]
+                self._token_expires_at = time.monotonic() + payload.get("expires_in", 3600) - 60
+            return self._token
+
+    async def get(self, http_session: aiohttp.ClientSession, url: str, params: dict = None) -> dict:
+        if not url.startswith("https://"):
+            url = f"{self.API_BASE}{url}"
+        for _ in range(3):
+            token = await self._access_token(http_session)
+            async with http_session.get(url, params=params, headers={"Authorization": f"Bearer {token}"}) as response:
+                if response.status == 429:
+                    await asyncio.sleep(min(int(response.headers.get("Retry-After", "1")), 30))
+                    continue
+                if response.status == 401:
+                    self._token = None
+                    continue
+                if response.status == 404:
+                    raise ValueError("This album or playlist doesn't exist or isn't public.")
+                if response.status != 200:
+                    raise ValueError(f"The Spotify API returned status {response.status}.")
+                return await response.json()
+        raise ValueError("The Spotify API is busy right now, please try again later.")
+
+    async def collection_tracks(self, http_session: aiohttp.ClientSession, kind: str, collection_id: str, limit: int):
+        """
+        Lists the tracks of an album or playlist, following pagination up to
+        `limit` tracks. Returns (name, [{'id', 'name', 'artists', 'duration'}, ...]).
+        """
+        collection = await self.get(http_session, f"/{kind}s/{collection_id}")
+        name = collection.get("name", "")
+        page = collection["tracks"]
+        tracks = []
+        while True:
+            for item in page.get("items", []):
+                # Playlist items wrap the track; album items are the track
+                track = item.get("track", item) if kind == "playlist" else item
+                if not track or not track.get("id") or track.get("is_local"):
+                    continue
+                tracks.append({
+                    "id": track["id"],
+                    "name": track.get("name", ""),
+                    "artists": ", ".join(a.get("name", "") for a in track.get("artists", [])),
+                    "duration": (track.get("duration_ms") or 0) // 1000,
+                })
+                if len(tracks) >= limit:
+                    return name, tracks
+            if not page.get("next"):
+                return name, tracks
+            page = await self.get(http_session, page["next"])
+
+
+_spotify_api = None
+
+def get_spotify_api():
+    """Returns the Web API client, or None if SPOTIFY_CLIENT_ID/SPOTIFY_CLIENT_SECRET aren't set."""
+    global _spotify_api
+    if _spotify_api is None:
+        client_id = os.getenv("SPOTIFY_CLIENT_ID")
+        client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
+        if not client_id or not client_secret:
+            return None
+        _spotify_api = SpotifyAPI(client_id, client_secret)
+        logging.info("Spotify Web API client configured")
+    return _spotify_api
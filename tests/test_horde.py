@@ -0,0 +1,98 @@
+"""
+HordePoller against tools/fake_horde.py, served on a free local port.
+Poll intervals are scaled down so the whole file runs in a few seconds.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import horde
+from horde import HordePoller, HordeError
+from tools.fake_horde import FakeHorde
+
+PAYLOAD = {"prompt": "a lighthouse at dusk", "params": {"n": 2, "width": 64, "height": 64}}
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(horde, "MIN_POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(horde, "MAX_POLL_INTERVAL", 1.0)
+
+
+@asynccontextmanager
+async def fake_horde(monkeypatch, delay, seconds_per_position=0.5):
+    """Serves a FakeHorde on a free port and points HORDE_API_BASE at it. Yields (fake, poller)."""
+    fake = FakeHorde(delay, fault_rate=0, public_url="http://127.0.0.1", seconds_per_position=seconds_per_position)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    monkeypatch.setenv("HORDE_API_BASE", f"http://127.0.0.1:{port}/api/v2")
+    try:
+        async with aiohttp.ClientSession() as session:
+            yield fake, HordePoller(session)
+    finally:
+        await runner.cleanup()
+
+
+async def submit(poller):
+    return await poller.submit(PAYLOAD, api_key="0000000000", client_agent="tests:1:test")
+
+
+def test_jobs_finish_with_decreasing_queue_position(monkeypatch):
+    async def run():
+        async with fake_horde(monkeypatch, delay=3) as (fake, poller):
+            updates = {}
+
+            def recorder(job_id):
+                async def on_update(check):
+                    updates.setdefault(job_id, []).append(check["queue_position"])
+                return on_update
+
+            job_ids = [await submit(poller) for _ in range(2)]
+            results = await asyncio.gather(*(poller.wait(job_id, timeout=10, on_update=recorder(job_id))
+                                             for job_id in job_ids))
+            return job_ids, results, updates, len(poller)
+
+    job_ids, results, updates, still_tracked = asyncio.run(run())
+    for result in results:
+        assert result["done"] and len(result["generations"]) == 2
+    for job_id in job_ids:
+        positions = updates[job_id]
+        assert positions[0] > 0
+        assert positions == sorted(positions, reverse=True)
+        assert len(set(positions)) >= 2
+    assert still_tracked == 0
+
+
+def test_polls_follow_wait_time_within_bounds(monkeypatch):
+    async def run():
+        async with fake_horde(monkeypatch, delay=3) as (fake, poller):
+            job_id = await submit(poller)
+            await poller.wait(job_id, timeout=10)
+            return [(at, wait_time) for at, polled, wait_time in fake.check_log if polled == job_id]
+
+    checks = asyncio.run(run())
+    assert len(checks) >= 3
+    for (at, wait_time), (next_at, _) in zip(checks, checks[1:]):
+        expected = min(max(wait_time / 2, horde.MIN_POLL_INTERVAL), horde.MAX_POLL_INTERVAL)
+        assert expected - 0.05 <= next_at - at <= expected + 0.3
+
+
+def test_timeout_raises_and_cancels_the_job(monkeypatch):
+    monkeypatch.setenv("HORDE_TIMEOUT", "0.5")
+
+    async def run():
+        async with fake_horde(monkeypatch, delay=30) as (fake, poller):
+            job_id = await submit(poller)
+            with pytest.raises(HordeError):
+                await poller.wait(job_id)
+            return job_id, fake.cancelled, len(poller)
+
+    job_id, cancelled, still_tracked = asyncio.run(run())
+    assert cancelled == [job_id]
+    assert still_tracked == 0
@@ -0,0 +1,139 @@
+"""
+A local stand-in for the Stable Horde image generation API, for trying out
+/imagine without kudos or queue time.
+
+    python tools/fake_horde.py --port 7001 --delay 20
+    HORDE_API_BASE=http://127.0.0.1:7001/api/v2 python bot.py
+
+Jobs wait in a simulated queue for --delay seconds, reporting a shrinking
+queue_position and wait_time, and then return placeholder images. Telegram
+fetches the images by URL, so when running against the real Bot API pass
+--public-url with an address Telegram can reach.
+"""
+import io
+import time
+import uuid
+import random
+import argparse
+
+from aiohttp import web
+from PIL import Image, ImageDraw
+
+
+class FakeHorde:
+    def __init__(self, delay: float, fault_rate: float, public_url: str, seconds_per_position: float = 5):
+        self.delay = delay
+        self.fault_rate = fault_rate
+        self.public_url = public_url.rstrip("/")
+        self.seconds_per_position = seconds_per_position
+        self.jobs = {}  # id -> job dict
+        self.checks = 0
+        self.check_log = []  # (monotonic time, job id, wait_time) of every check
+        self.cancelled = []  # ids of jobs cancelled with DELETE
+
+    def _job(self, request):
+        job = self.jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound(text='{"message": "Job not found"}', content_type="application/json")
+        return job
+
+    def _remaining(self, job):
+        return max(0.0, job["ready_at"] - time.monotonic())
+
+    async def submit(self, request):
+        if not request.headers.get("apikey"):
+            return web.json_response({"message": "No API key"}, status=401)
+        payload = await request.json()
+        if not payload.get("prompt"):
+            return web.json_response({"message": "Prompt is required"}, status=400)
+        params = payload.get("params", {})
+        job_id = str(uuid.uuid4())
+        self.jobs[job_id] = {
+            "prompt": payload["prompt"],
+            "n": int(params.get("n", 1)),
+            "width": int(params.get("width", 512)),
+            "height": int(params.get("height", 512)),
+            "model": (payload.get("models") or ["stable_diffusion"])[0],
+            "ready_at": time.monotonic() + self.delay,
+            "faulted": random.random() < self.fault_rate,
+        }
+        return web.json_response({"id": job_id, "kudos": 10.0}, status=202)
+
+    async def check(self, request):
+        self.checks += 1
+        job = self._job(request)
+        remaining = self._remaining(job)
+        done = remaining == 0 and not job["faulted"]
+        self.check_log.append((time.monotonic(), request.match_info["job_id"], int(remaining)))
+        # Spend the first half of the delay queued and the second half processing
+        queued = remaining > self.delay / 2
+        return web.json_response({
+            "finished": job["n"] if done else 0,
+            "processing": 0 if done or queued else job["n"],
+            "restarted": 0,
+            "waiting": job["n"] if queued else 0,
+            "done": done,
+            "faulted": job["faulted"] and remaining == 0,
+            "wait_time": int(remaining),
+            "queue_position": int(remaining // self.seconds_per_position) if queued else 0,
+            "kudos": 10.0,
+            "is_possible": True,
+        })
+
+    async def status(self, request):
+        job = self._job(request)
+        job_id = request.match_info["job_id"]
+        done = self._remaining(job) == 0 and not job["faulted"]
+        generations = [{
+            "img": f"{self.public_url}/img/{job_id}/{i}.png",
+            "seed": str(random.randrange(2 ** 32)),
+            "id": str(uuid.uuid4()),
+            "censored": False,
+            "model": job["model"],
+            "worker_id": "00000000-0000-0000-0000-000000000000",
+            "worker_name": "fake-horde",
+            "state": "ok",
+        } for i in range(job["n"])] if done else []
+        return web.json_response({"done": done, "faulted": job["faulted"], "generations": generations})
+
+    async def cancel(self, request):
+        job = self._job(request)
+        del self.jobs[request.match_info["job_id"]]
+        self.cancelled.append(request.match_info["job_id"])
+        return web.json_response({"done": False, "faulted": False, "generations": [], "prompt": job["prompt"]})
+
+    async def image(self, request):
+        job = self._job(request)
+        index = int(request.match_info["index"])
+        rng = random.Random(f"{job['prompt']}/{index}")
+        img = Image.new("RGB", (job["width"], job["height"]), tuple(rng.randrange(256) for _ in range(3)))
+        ImageDraw.Draw(img).text((16, 16), f"#{index + 1}: {job['prompt'][:60]}", fill=(255, 255, 255))
+        with io.BytesIO() as buffer:
+            img.save(buffer, format="PNG")
+            return web.Response(body=buffer.getvalue(), content_type="image/png")
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/api/v2/generate/async", self.submit)
+        app.router.add_get("/api/v2/generate/check/{job_id}", self.check)
+        app.router.add_get("/api/v2/generate/status/{job_id}", self.status)
+        app.router.add_delete("/api/v2/generate/status/{job_id}", self.cancel)
+        app.router.add_get("/img/{job_id}/{index}.png", self.image)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Stable Horde API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7001)
+    parser.add_argument("--delay", type=float, default=20, help="seconds each job takes")
+    parser.add_argument("--fault-rate", type=float, default=0, help="share of jobs that fault (0-1)")
+    parser.add_argument("--public-url", help="base URL for image links (default: http://HOST:PORT)")
+    args = parser.parse_args()
+
+    horde = FakeHorde(args.delay, args.fault_rate, args.public_url or f"http://{args.host}:{args.port}")
+    web.run_app(horde.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Reports what each handler module costs to import: wall time and resident
+memory on top of what the bot needs just to start.
+
+Every module is measured in a fresh interpreter, so shared dependencies are
+counted for each module that uses them. Run from the repository root:
+
+    python tools/import_cost.py
+"""
+import os
+import sys
+import json
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import sys, time, json, resource
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import app, handlers
+base_seconds = time.perf_counter() - started
+base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+name = {name!r}
+started = time.perf_counter()
+if name:
+    handlers.load_handler_module(name)
+print(json.dumps({{
+    "base_seconds": base_seconds,
+    "seconds": time.perf_counter() - started,
+    "base_rss_kb": base_rss,
+    "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss,
+}}))
+"""
+
+
+def probe(name):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(root=ROOT, name=name)],
+        check=True, capture_output=True, text=True, cwd=ROOT,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    from handlers import LAZY_MODULES
+
+    startup = probe("")
+    print(f"Bot startup imports: {startup['base_seconds'] * 1000:7.0f} ms  {startup['base_rss_kb'] / 1024:6.1f} MB")
+    print()
+    print(f"{'handler module':<24}{'import':>10}{'memory':>12}")
+    costs = sorted(((name, probe(name)) for name in LAZY_MODULES), key=lambda item: -item[1]["seconds"])
+    for name, cost in costs:
+        print(f"{name:<24}{cost['seconds'] * 1000:7.0f} ms{cost['rss_kb'] / 1024:9.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
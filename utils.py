@@ -1,6 +1,14 @@
 import os
+import glob
+import time
+import asyncio
+import logging
 import subprocess
 
+from aiogram.types import FSInputFile
+
+from metrics import stage, FFMPEG_SECONDS
+
 MAX_SIZE = 50 * 1024 * 1024  # 50 MB
 
 def format_duration(seconds):
@@ -18,9 +26,10 @@ def format_duration(seconds):
     except (TypeError, ValueError):
         return "N/A"
 
-def compress_video_to_target_size(input_path, output_path, duration_seconds):
+def compute_bitrates(duration_seconds):
     """
-    Compresses a video to a target size by calculating the required bitrate.
+    Calculates the video and audio bitrates (in kbit/s) needed to fit a video
+    of the given duration into the target size.
     """
     target_size_mb = 48
     target_size_bits = target_size_mb * 1024 * 1024 * 8
@@ -41,11 +50,14 @@ def compress_video_to_target_size(input_path, output_path, duration_seconds):
         video_bitrate_bits = 100 * 1000
         audio_bitrate_bits = 64 * 1000
 
-    video_bitrate_k = int(video_bitrate_bits / 1000)
-    audio_bitrate_k = int(audio_bitrate_bits / 1000)
+    return int(video_bitrate_bits / 1000), int(audio_bitrate_bits / 1000)
 
-    # FFmpeg command to compress the video
-    cmd = [
+def build_compress_command(input_path, output_path, duration_seconds):
+    """
+    Builds the FFmpeg command that compresses a video to the target size.
+    """
+    video_bitrate_k, audio_bitrate_k = compute_bitrates(duration_seconds)
+    return [
         "ffmpeg", "-y", "-i", input_path,
         "-c:v", "libx264", "-b:v", f"{video_bitrate_k}k",
         "-c:a", "aac", "-b:a", f"{audio_bitrate_k}k",
@@ -53,7 +65,264 @@ def compress_video_to_target_size(input_path, output_path, duration_seconds):
         "-v", "error", # Only show errors in the console
         output_path
     ]
-    subprocess.run(cmd, check=True)
+
+class CompressionQueueFull(Exception):
+    """Raised when too many videos are already waiting to be compressed."""
+
+class CompressionService:
+    """
+    Runs FFmpeg compressions as asyncio subprocesses. At most `max_concurrent`
+    encodes run at once, at most `max_queue` jobs may wait for a slot, and each
+    encode is killed if it exceeds `timeout` seconds or its task is cancelled.
+    """
+
+    def __init__(self, max_concurrent=None, max_queue=None, timeout=None):
+        self.max_concurrent = max_concurrent or int(os.getenv("COMPRESS_CONCURRENCY", "0")) or os.cpu_count() or 1
+        self.max_queue = max_queue or int(os.getenv("COMPRESS_MAX_QUEUE", "20"))
+        self.timeout = timeout or float(os.getenv("COMPRESS_TIMEOUT", "900"))
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self.total_wait_seconds = 0.0
+        self.total_encode_seconds = 0.0
+
+    async def compress(self, input_path, output_path, duration_seconds, timeout=None, on_progress=None):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise CompressionQueueFull("The compression queue is full, please try again in a few minutes.")
+
+        queued_at = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        started_at = time.monotonic()
+        self.total_wait_seconds += started_at - queued_at
+        self.running += 1
+        try:
+            cmd = build_compress_command(input_path, output_path, duration_seconds)
+            if on_progress is not None:
+                # Machine-readable progress on stdout instead of the stats line
+                cmd[1:1] = ["-progress", "pipe:1", "-nostats"]
+            await self._run_ffmpeg(cmd, timeout or self.timeout, on_progress, duration_seconds)
+            self.completed += 1
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            encode_seconds = time.monotonic() - started_at
+            self.total_encode_seconds += encode_seconds
+            FFMPEG_SECONDS.inc(encode_seconds)
+            self.running -= 1
+            self._semaphore.release()
+            logging.info("Compression of %s waited %.1fs, encoded in %.1fs",
+                         input_path, started_at - queued_at, encode_seconds)
+
+    async def _run_ffmpeg(self, cmd, timeout, on_progress=None, duration_seconds=0):
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE if on_progress else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            if on_progress is None:
+                _, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            else:
+                stderr = await asyncio.wait_for(read_ffmpeg_progress(proc, on_progress, duration_seconds), timeout)
+        except BaseException:
+            # Timed out or the handler was cancelled: don't leave FFmpeg running
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+
+    def stats(self):
+        finished = self.completed + self.failed + self.timed_out
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "rejected": self.rejected,
+            "total_wait_seconds": self.total_wait_seconds,
+            "total_encode_seconds": self.total_encode_seconds,
+            "avg_wait_seconds": self.total_wait_seconds / finished if finished else 0.0,
+            "avg_encode_seconds": self.total_encode_seconds / finished if finished else 0.0,
+        }
+
+async def read_ffmpeg_progress(proc, on_progress, duration_seconds):
+    """
+    Reads the key=value blocks FFmpeg writes with -progress pipe:1 and calls
+    on_progress(fraction, speed) at the end of each block. fraction is None
+    if the duration is unknown. Waits for FFmpeg to exit and returns its stderr.
+    """
+    try:
+        duration = float(duration_seconds or 0)
+    except (TypeError, ValueError):
+        duration = 0
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    try:
+        block = {}
+        async for line in proc.stdout:
+            key, _, value = line.decode(errors="replace").strip().partition("=")
+            block[key] = value
+            if key != "progress":
+                continue
+            try:
+                # Despite its name, out_time_ms is in microseconds too
+                out_seconds = int(block.get("out_time_us") or block.get("out_time_ms") or 0) / 1_000_000
+            except ValueError:
+                out_seconds = 0
+            fraction = min(1.0, out_seconds / duration) if duration > 0 else None
+            speed = block.get("speed", "").strip()
+            on_progress(fraction, speed if speed not in ("", "N/A") else None)
+            block = {}
+        await proc.wait()
+        return await stderr_task
+    finally:
+        stderr_task.cancel()
+
+# The shared compression service, created on first use
+_compression_service = None
+
+def get_compression_service():
+    global _compression_service
+    if _compression_service is None:
+        _compression_service = CompressionService()
+    return _compression_service
+
+async def compress_video(input_path, output_path, duration_seconds, timeout=None, on_progress=None):
+    """
+    Compresses a video to the target size without blocking the event loop.
+    on_progress(fraction, speed) is called as FFmpeg reports its progress.
+    """
+    with stage("compress"):
+        await get_compression_service().compress(input_path, output_path, duration_seconds, timeout, on_progress)
+
+# How oversized videos are delivered: re-encoded into one file, or cut into parts
+OVERSIZE_MODES = ("compress", "split")
+OVERSIZE_FLAGS = {"--compress": "compress", "--split": "split"}
+
+def parse_delivery_args(arg_text):
+    """
+    Splits the command argument into the URL and an optional delivery flag,
+    e.g. "/tik <url> --split". Returns (url, mode); mode is None if not given.
+    """
+    mode = None
+    words = []
+    for word in arg_text.split():
+        if word.lower() in OVERSIZE_FLAGS:
+            mode = OVERSIZE_FLAGS[word.lower()]
+        else:
+            words.append(word)
+    return " ".join(words), mode
+
+def oversize_mode(requested=None):
+    """
+    Returns the delivery mode for videos above MAX_SIZE. A per-request flag wins,
+    otherwise the OVERSIZE_MODE environment variable decides (default: compress).
+    """
+    if requested in OVERSIZE_MODES:
+        return requested
+    mode = os.getenv("OVERSIZE_MODE", "compress").lower()
+    return mode if mode in OVERSIZE_MODES else "compress"
+
+async def _run_tool(cmd, timeout):
+    """Runs an FFmpeg/FFprobe command, killing it on timeout or cancellation. Returns stdout."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return stdout
+
+async def probe_duration(path):
+    """Reads a media file's duration in seconds with FFprobe."""
+    stdout = await _run_tool([
+        "ffprobe", "-v", "error", "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1", path
+    ], timeout=60)
+    return float(stdout.decode().strip() or 0)
+
+async def split_video_stream_copy(input_path, output_prefix, duration_seconds, max_size=MAX_SIZE, attempts=3):
+    """
+    Cuts a video into keyframe-aligned parts no larger than max_size using
+    FFmpeg's segment muxer with stream copy, so nothing is re-encoded.
+    Parts are written as {output_prefix}000.mp4, {output_prefix}001.mp4, ...
+    and their paths are returned in order.
+    """
+    try:
+        duration = float(duration_seconds or 0)
+    except (TypeError, ValueError):
+        duration = 0
+    if duration <= 0:
+        duration = await probe_duration(input_path)
+    if duration <= 0:
+        raise ValueError("Could not determine the video duration for splitting.")
+
+    file_size = os.path.getsize(input_path)
+    # Leave headroom because parts can only end on a keyframe
+    segment_seconds = max(1.0, duration * (max_size * 0.9) / file_size)
+    timeout = float(os.getenv("SPLIT_TIMEOUT", "300"))
+
+    with stage("split"):
+        for _ in range(attempts):
+            await _run_tool([
+                "ffmpeg", "-y", "-i", input_path,
+                "-map", "0:v:0", "-map", "0:a?", "-c", "copy",
+                "-f", "segment", "-segment_time", f"{segment_seconds:.2f}",
+                "-reset_timestamps", "1", "-segment_format_options", "movflags=+faststart",
+                "-v", "error",
+                f"{output_prefix}%03d.mp4"
+            ], timeout)
+            part_paths = sorted(glob.glob(f"{glob.escape(output_prefix)}[0-9][0-9][0-9].mp4"))
+            largest = max((os.path.getsize(p) for p in part_paths), default=0)
+            if part_paths and largest <= max_size:
+                return part_paths
+
+            # Sparse keyframes produced an oversized part: retry with shorter segments
+            cleanup_files(*part_paths)
+            if largest:
+                segment_seconds = max(1.0, segment_seconds * (max_size * 0.9) / largest)
+
+    raise ValueError("Could not split this video into parts under 50MB.")
+
+def part_caption(caption, index, total):
+    """The caption of part `index` (from 1) of a split video. The full caption goes on the first part."""
+    label = f"🎞 <b>Part {index}/{total}</b>"
+    return f"{caption}\n{label}" if index == 1 and caption else label
+
+async def send_video_parts(bot, chat_id, part_paths, caption):
+    """
+    Sends the parts of a split video as numbered videos. The full caption goes
+    on the first part. Returns the sent messages.
+    """
+    total = len(part_paths)
+    sent = []
+    for i, path in enumerate(part_paths, start=1):
+        sent.append(await bot.send_video(
+            chat_id, video=FSInputFile(path), caption=part_caption(caption, i, total), parse_mode="HTML", request_timeout=300
+        ))
+    return sent
 
 def cleanup_files(*paths):
     """
@@ -0,0 +1,215 @@
+import os
+import time
+import shutil
+import asyncio
+import secrets
+import logging
+import itertools
+from contextlib import asynccontextmanager
+
+# What an audio job needs at most: the downloaded stream plus the converted mp3
+AUDIO_JOB_BYTES = 40 * 1024 * 1024
+
+# Our own directory inside WORKSPACE_TMPFS_DIR, which is usually shared with other programs
+TMPFS_SUBDIR = "bot-workspaces"
+
+
+class InsufficientSpace(Exception):
+    """Raised when there isn't enough free disk space to admit a job."""
+
+
+def projected_size(info, default=None):
+    """
+    Estimates the bytes a download will write from an extracted info dict:
+    the selected formats' sizes, doubled because merging, compressing or
+    splitting keeps a second copy around. Returns `default` if yt-dlp didn't
+    report the sizes.
+    """
+    if not info:
+        return default
+    formats = info.get('requested_formats') or [info]
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    if not all(sizes):
+        return default
+    return 2 * int(sum(sizes))
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace:
+    """A job's private scratch directory."""
+
+    def __init__(self, directory):
+        self.dir = directory
+
+    def path(self, name):
+        """Returns the path of a file inside the workspace."""
+        return os.path.join(self.dir, name)
+
+
+class WorkspaceManager:
+    """
+    Gives every job its own scratch directory and removes it when the job
+    ends, however it ends. Jobs are only admitted if the disk will still have
+    WORKSPACE_MIN_FREE_MB left after their projected size and whatever the
+    running jobs are still expected to write. Small jobs go to the
+    bot-workspaces directory in WORKSPACE_TMPFS_DIR (e.g. /dev/shm) when that
+    is set and has room; the sweeper only ever looks inside that directory.
+
+    Directories are named <pid>_<run token>_<job name>_<n>. The token is new
+    for every start of the bot, so the sweeper can tell leftovers of an
+    earlier run apart from live workspaces even when the bot restarts with
+    the same pid (always 1 in a container).
+    """
+
+    def __init__(self, root=None, tmpfs_root=None):
+        self.root = os.path.abspath(root or os.getenv("WORKSPACE_DIR", "workspaces"))
+        tmpfs_dir = tmpfs_root or os.getenv("WORKSPACE_TMPFS_DIR")
+        self.tmpfs_root = os.path.join(os.path.abspath(tmpfs_dir), TMPFS_SUBDIR) if tmpfs_dir else None
+        self.tmpfs_max_bytes = int(float(os.getenv("WORKSPACE_TMPFS_MAX_MB", "64")) * 1024 * 1024)
+        self.min_free_bytes = int(float(os.getenv("WORKSPACE_MIN_FREE_MB", "512")) * 1024 * 1024)
+        self.default_job_bytes = int(float(os.getenv("WORKSPACE_DEFAULT_JOB_MB", "200")) * 1024 * 1024)
+        self.max_age = float(os.getenv("WORKSPACE_MAX_AGE", str(6 * 3600)))
+        self._active = {}  # directory -> (root, projected bytes)
+        self._ids = itertools.count(1)
+        self._admission = asyncio.Lock()
+        self.owner = f"{os.getpid()}_{secrets.token_hex(4)}"
+        self.rejected = 0
+        os.makedirs(self.root, exist_ok=True)
+        if self.tmpfs_root:
+            os.makedirs(self.tmpfs_root, exist_ok=True)
+
+    @property
+    def active(self) -> int:
+        return len(self._active)
+
+    def _still_to_write(self, root):
+        """Bytes the running jobs on `root` are projected to write on top of what they already have."""
+        # A snapshot, since jobs on the event loop come and go while this runs in a thread
+        return sum(max(0, projected - _dir_size(directory))
+                   for directory, (job_root, projected) in list(self._active.items()) if job_root == root)
+
+    def _has_room(self, root, projected, keep_free):
+        free = shutil.disk_usage(root).free
+        return free - self._still_to_write(root) - projected >= keep_free
+
+    def admit(self, projected):
+        """
+        Returns the root directory a job of `projected` bytes should use, or
+        raises InsufficientSpace. This walks the running jobs' directories, so
+        call it from a worker thread.
+        """
+        if self.tmpfs_root and projected <= self.tmpfs_max_bytes and self._has_room(self.tmpfs_root, projected, 0):
+            return self.tmpfs_root
+        if self._has_room(self.root, projected, self.min_free_bytes):
+            return self.root
+        self.rejected += 1
+        raise InsufficientSpace("The server is low on disk space right now. Please try again in a few minutes.")
+
+    @asynccontextmanager
+    async def job(self, name, projected_bytes=None):
+        """
+        Admits a job and yields its Workspace. The directory and everything
+        in it is deleted when the block exits.
+        """
+        projected = projected_bytes or self.default_job_bytes
+        # One admission at a time, so two jobs can't both take the same free space
+        async with self._admission:
+            root = await asyncio.to_thread(self.admit, projected)
+            directory = os.path.join(root, f"{self.owner}_{name}_{next(self._ids)}")
+            # Registered before it exists, so a concurrent sweep never sees it unowned
+            self._active[directory] = (root, projected)
+        try:
+            os.makedirs(directory)
+            yield Workspace(directory)
+        finally:
+            del self._active[directory]
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def sweep(self):
+        """
+        Removes workspaces that no running job owns when they were left
+        behind by an earlier run of this process, by a bot process that is
+        gone, or are older than WORKSPACE_MAX_AGE. Returns the number removed.
+        """
+        removed = 0
+        now = time.time()
+        pid = str(os.getpid())
+        for root in filter(None, (self.root, self.tmpfs_root)):
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False) or entry.path in self._active:
+                    continue
+                owner, _, _ = entry.name.partition("_")
+                if not owner.isdigit():
+                    continue  # not one of ours
+                try:
+                    age = now - entry.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    continue
+                if owner == pid:
+                    # Ours, or from an earlier run that had the same pid; either way no job uses it
+                    orphaned = True
+                else:
+                    orphaned = not _pid_alive(int(owner))
+                if orphaned or age > self.max_age:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+        if removed:
+            logging.info("Removed %d stale workspace(s)", removed)
+        return removed
+
+    async def sweep_periodically(self, interval=None):
+        """Sweeps every WORKSPACE_SWEEP_INTERVAL seconds (default 15 minutes) until cancelled."""
+        interval = interval or float(os.getenv("WORKSPACE_SWEEP_INTERVAL", "900"))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                logging.warning("Workspace sweep failed: %s", e)
+
+
+_manager = None
+
+
+def get_workspace_manager() -> WorkspaceManager:
+    """Returns the shared workspace manager, created on first use."""
+    global _manager
+    if _manager is None:
+        _manager = WorkspaceManager()
+    return _manager
+
+
+def job_workspace(name, projected_bytes=None):
+    """Shortcut for get_workspace_manager().job(name, projected_bytes)."""
+    return get_workspace_manager().job(name, projected_bytes)
+
+
+def start_sweeper():
+    """Sweeps stale workspaces now and starts the periodic sweep. Returns its task."""
+    manager = get_workspace_manager()
+    manager.sweep()
+    return asyncio.create_task(manager.sweep_periodically())
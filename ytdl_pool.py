@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import asyncio
+import itertools
+import threading
+import logging
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+# The shared pool of yt-dlp worker processes, created by start_pool()
+_executor = None
+# Progress updates from the workers, read by a thread in the bot process
+_progress_queue = None
+# In the bot process: job id -> (event loop, callback) for jobs that want progress
+_progress_listeners = {}
+_job_ids = itertools.count(1)
+
+# In a worker process: the queue to report to and the job currently running
+_worker_queue = None
+_current_job = None
+_last_report = 0.0
+
+
+class YtdlJobError(Exception):
+    """Raised in the bot process when a yt-dlp job fails inside a worker."""
+
+
+def _warm_up_worker(progress_queue=None):
+    """
+    Runs once in every worker process. Importing yt-dlp and building its
+    extractor registry here means the first real job doesn't pay for it.
+    """
+    global _worker_queue
+    _worker_queue = progress_queue
+    import yt_dlp
+    from yt_dlp.extractor import gen_extractor_classes
+    gen_extractor_classes()
+    logging.getLogger(__name__).debug("yt-dlp worker %s is ready", os.getpid())
+
+
+def _ping():
+    return os.getpid()
+
+
+# Per worker process: YoutubeDL instances kept between jobs, keyed by their
+# options apart from the output template, least recently used first
+_instances = OrderedDict()
+
+
+def _report(update, force=False):
+    """Sends a progress update for the current job to the bot process, at most twice a second."""
+    global _last_report
+    if _worker_queue is None or _current_job is None:
+        return
+    now = time.monotonic()
+    if not force and now - _last_report < 0.5:
+        return
+    _last_report = now
+    _worker_queue.put((_current_job, update))
+
+
+def _progress_hook(d):
+    if d["status"] == "downloading":
+        _report({
+            "status": "downloading",
+            "downloaded": d.get("downloaded_bytes"),
+            "total": d.get("total_bytes") or d.get("total_bytes_estimate"),
+            "speed": d.get("speed"),
+            "eta": d.get("eta"),
+        })
+    elif d["status"] == "finished":
+        _report({"status": "finished"}, force=True)
+
+
+def _postprocessor_hook(d):
+    if d["status"] == "started":
+        _report({"status": "postprocess", "postprocessor": d.get("postprocessor")}, force=True)
+
+
+def _instance_key(ydl_opts):
+    opts = {k: v for k, v in ydl_opts.items() if k != "outtmpl"}
+    # Cookies are read once per instance, so an updated cookie file needs a new one
+    cookiefile = opts.get("cookiefile")
+    mtime = os.path.getmtime(cookiefile) if cookiefile and os.path.exists(cookiefile) else None
+    return json.dumps(opts, sort_keys=True, default=repr), mtime
+
+
+def _pooled_ydl(ydl_opts):
+    """
+    Executed inside a worker process. Returns a YoutubeDL for these options,
+    reusing the one from an earlier job when there is one, so the options,
+    cookie jar, extractor instances and HTTP connections are only set up
+    once. The job's output template is applied to it each time.
+    """
+    import yt_dlp
+    from yt_dlp.utils import DEFAULT_OUTTMPL
+    key = _instance_key(ydl_opts)
+    ydl = _instances.pop(key, None)
+    if ydl is None:
+        ydl = yt_dlp.YoutubeDL({k: v for k, v in ydl_opts.items() if k != "outtmpl"})
+        ydl.add_progress_hook(_progress_hook)
+        ydl.add_postprocessor_hook(_postprocessor_hook)
+        max_instances = int(os.getenv("YTDL_INSTANCES_PER_WORKER", "16"))
+        while _instances and len(_instances) >= max_instances:
+            _, oldest = _instances.popitem(last=False)
+            oldest.close()
+    _instances[key] = ydl
+    outtmpl = ydl_opts.get("outtmpl") or DEFAULT_OUTTMPL["default"]
+    ydl.params["outtmpl"]["default"] = outtmpl
+    return ydl
+
+
+def _run_extract(url, ydl_opts, download, job_id=None):
+    """
+    Executed inside a worker process. Returns a picklable copy of the info
+    dict together with the path yt-dlp chose for the downloaded file.
+    """
+    global _current_job
+    _current_job = job_id
+    try:
+        ydl = _pooled_ydl(ydl_opts)
+        info = ydl.extract_info(url, download=download)
+        file_path = ydl.prepare_filename(info) if info else None
+        return ydl.sanitize_info(info), file_path
+    except Exception as e:
+        # yt-dlp exceptions don't always survive pickling, so send back the message only
+        raise YtdlJobError(str(e)) from None
+    finally:
+        _current_job = None
+
+
+def _run_process_info(info, ydl_opts, job_id=None):
+    """
+    Executed inside a worker process. Downloads from an info dict that was
+    extracted earlier, so yt-dlp only selects formats and fetches the media.
+    """
+    global _current_job
+    _current_job = job_id
+    try:
+        ydl = _pooled_ydl(ydl_opts)
+        info = ydl.process_ie_result(info, download=True)
+        return ydl.sanitize_info(info), ydl.prepare_filename(info)
+    except Exception as e:
+        raise YtdlJobError(str(e)) from None
+    finally:
+        _current_job = None
+
+
+def _read_progress(progress_queue):
+    """
+    Runs in a thread of the bot process. Hands each worker update to the
+    event loop of the job it belongs to, until shutdown_pool() sends None.
+    """
+    while True:
+        job_id, update = progress_queue.get()
+        if job_id is None:
+            return
+        listener = _progress_listeners.get(job_id)
+        if listener is not None:
+            loop, callback = listener
+            loop.call_soon_threadsafe(callback, update)
+
+
+def start_pool(workers=None):
+    """
+    Starts the worker pool (once) and spawns every worker right away so they
+    are warm before the first download arrives. The size defaults to the
+    YTDL_WORKERS environment variable.
+    """
+    global _executor
+    if _executor is not None:
+        return _executor
+
+    if workers is None:
+        workers = int(os.getenv("YTDL_WORKERS", "4"))
+    workers = max(1, workers)
+
+    global _progress_queue
+    context = multiprocessing.get_context("spawn")
+    _progress_queue = context.Queue()
+    threading.Thread(target=_read_progress, args=(_progress_queue,), name="ytdl-progress", daemon=True).start()
+
+    _executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_warm_up_worker,
+        initargs=(_progress_queue,),
+    )
+    # Each ping needs an idle worker, so submitting one per slot spawns them all
+    for _ in range(workers):
+        _executor.submit(_ping)
+
+    logging.info("Started yt-dlp worker pool with %d process(es)", workers)
+    return _executor
+
+
+def shutdown_pool():
+    """Stops the worker pool, dropping any jobs that haven't started yet."""
+    global _executor, _progress_queue
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _progress_queue is not None:
+        _progress_queue.put((None, None))
+        _progress_queue = None
+
+
+@contextmanager
+def _listening(on_progress):
+    """Registers on_progress for a job's updates and yields the job id to pass to the worker."""
+    if on_progress is None:
+        yield None
+        return
+    job_id = next(_job_ids)
+    _progress_listeners[job_id] = (asyncio.get_running_loop(), on_progress)
+    try:
+        yield job_id
+    finally:
+        del _progress_listeners[job_id]
+
+
+async def extract_info(url, ydl_opts, download=True, on_progress=None):
+    """
+    Runs YoutubeDL.extract_info in the worker pool and waits for it without
+    blocking the event loop. Returns a tuple of (info, file_path).
+    on_progress, if given, is called on the event loop with each progress
+    update dict ("status" is downloading, finished or postprocess).
+    """
+    # Imported here so the spawned workers, which import this module, don't load aiogram
+    from metrics import stage, count_downloaded
+    loop = asyncio.get_running_loop()
+    with stage("download" if download else "extract"), _listening(on_progress) as job_id:
+        info, file_path = await loop.run_in_executor(start_pool(), _run_extract, url, ydl_opts, download, job_id)
+    if download:
+        count_downloaded(file_path)
+    return info, file_path
+
+
+async def process_info(info, ydl_opts, on_progress=None):
+    """
+    Downloads from a previously extracted info dict in the worker pool,
+    skipping the page and player requests. Returns (info, file_path).
+    """
+    from metrics import stage, count_downloaded
+    loop = asyncio.get_running_loop()
+    with stage("download"), _listening(on_progress) as job_id:
+        info, file_path = await loop.run_in_executor(start_pool(), _run_process_info, info, ydl_opts, job_id)
+    count_downloaded(file_path)
+    return info, file_path